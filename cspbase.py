@@ -1,5 +1,11 @@
+import abc
 import time
 import functools
+import itertools
+import heapq
+import random
+from array import array
+from bisect import bisect_left
 
 '''Constraint Satisfaction Routines
    A) class Variable
@@ -18,7 +24,8 @@ import functools
     B) class constraint
 
       This class allows one to define constraints specified by tables
-      of satisfying assignments.
+      of satisfying assignments. Subclasses (e.g., FunctionConstraint)
+      specify the constraint by a check function instead.
 
       On initialization the variables the constraint is over is
       specified (i.e. the scope of the constraint). This must be an
@@ -45,8 +52,11 @@ class Variable:
 
        The variable object offers two types of functionality to support
        search. 
-       (a) It has a current domain, implimented as a set of flags 
-           determining which domain values are "current", i.e., unpruned.
+       (a) It has a current domain, implimented as an array of flags 
+           determining which domain values are "current", i.e., unpruned,
+           together with a count of the current values and an index from
+           values to their position in the domain, so that pruning,
+           restoring, membership tests and size queries are all O(1).
            - you can prune a value, and restore it.
            - you can obtain a list of values in the current domain, or count
              how many are still there
@@ -82,7 +92,15 @@ class Variable:
         self.name = task.name           #text name for variable
         self.task = task
         self.dom = list(domain)         #Make a copy of passed domain
-        self.curdom = [True] * len(domain)      #using list
+        self.dom_index = dict()         #value -> position in dom
+        for i, val in enumerate(self.dom):
+            self.dom_index.setdefault(val, i)
+        self.curdom = bytearray([1]) * len(domain)  #flags, one byte per value
+        self.curdom_size = len(domain)  #number of flags set in curdom
+        #MRVQueue to notify when the current domain changes (set by bt_search)
+        self.queue = None
+        #Trail logging prunings so they can be undone (set by bt_search)
+        self.trail = None
         #for bt_search
         self.assignedValue = None
 
@@ -100,8 +118,10 @@ class Variable:
                 spans+=(n,)
                 val = n
             if not break_out:
+                self.dom_index.setdefault(spans, len(self.dom))
                 self.dom.append(spans)
-                self.curdom.append(True)
+                self.curdom.append(1)
+                self.curdom_size += 1
 
     def domain_size(self):
         '''Return the size of the (permanent) domain'''
@@ -117,46 +137,63 @@ class Variable:
 
     def prune_value(self, value):
         '''Remove value from CURRENT domain'''
-        self.curdom[self.value_index(value)] = False
+        i = self.value_index(value)
+        if self.curdom[i]:
+            self.curdom[i] = 0
+            self.curdom_size -= 1
+            if self.queue is not None:
+                self.queue.update(self)
+            if self.trail is not None:
+                self.trail.push_pruning(self, i)
 
     def unprune_value(self, value):
         '''Restore value to CURRENT domain'''
-        self.curdom[self.value_index(value)] = True
+        i = self.value_index(value)
+        if not self.curdom[i]:
+            self.curdom[i] = 1
+            self.curdom_size += 1
+            if self.queue is not None:
+                self.queue.update(self)
 
     def cur_domain(self):
         '''return list of values in CURRENT domain (if assigned 
            only assigned value is viewed as being in current domain)'''
-        vals = []
         if self.is_assigned():
-            vals.append(self.get_assigned_value())
-        else:
-            for i, val in enumerate(self.dom):
-                if self.curdom[i]:
-                    vals.append(val)
-        return vals
+            return [self.get_assigned_value()]
+        return list(itertools.compress(self.dom, self.curdom))
 
     def in_cur_domain(self, value):
         '''check if value is in CURRENT domain (without constructing list)
            if assigned only assigned value is viewed as being in current 
            domain'''
-        if not value in self.dom:
+        i = self.dom_index.get(value)
+        if i is None:
             return False
         if self.is_assigned():
             return value == self.get_assigned_value()
         else:
-            return self.curdom[self.value_index(value)]
+            return self.curdom[i] == 1
+
+    def in_cur_domain_index(self, i):
+        '''check if the i-th value of the domain is in CURRENT domain'''
+        if self.assignedValue is not None:
+            val = self.dom[i]
+            return val is self.assignedValue or val == self.assignedValue
+        return self.curdom[i] == 1
 
     def cur_domain_size(self):
         '''Return the size of the variables domain (without construcing list)'''
         if self.is_assigned():
             return 1
         else:
-            return(sum(1 for v in self.curdom if v))
+            return self.curdom_size
 
     def restore_curdom(self):
         '''return all values back into CURRENT domain'''
-        for i in range(len(self.curdom)):
-            self.curdom[i] = True
+        self.curdom = bytearray([1]) * len(self.dom)
+        self.curdom_size = len(self.dom)
+        if self.queue is not None:
+            self.queue.update(self)
 
     #
     #methods for assigning and unassigning
@@ -203,10 +240,18 @@ class Variable:
     #internal methods
     #
 
+    def trail_undo(self, i):
+        '''Called by Trail.undo: restore the i-th domain value'''
+        if not self.curdom[i]:
+            self.curdom[i] = 1
+            self.curdom_size += 1
+            if self.queue is not None:
+                self.queue.update(self)
+
     def value_index(self, value):
         '''Domain values need not be numbers, so return the index
            in the domain list of a variable value'''
-        return self.dom.index(value)
+        return self.dom_index[value]
 
     def __repr__(self):
         return("Var-{}".format(self.name))
@@ -218,7 +263,7 @@ class Variable:
         '''Also print the variable domain and current domain'''
         print("Var--\"{}\": Dom = {}, CurDom = {}".format(self.name, 
                                                              self.dom, 
-                                                             self.curdom))
+                                                             [v == 1 for v in self.curdom]))
 class Constraint: 
     '''Class for defining constraints variable objects specifes an
        ordering over variables.  This ordering is used when calling
@@ -236,39 +281,104 @@ class Constraint:
         in the scope such that this sequence of values satisfies the
         constraints).
 
-        NOTE: This is a very space expensive representation...a proper
-        constraint object would allow for representing the constraint
-        with a function.  
+        The tuples are stored encoded: each value is replaced by its
+        index in the domain of its variable, and the rows of indices are
+        kept one after the other in a single integer array. Subclasses
+        (e.g., FunctionConstraint) avoid storing tuples altogether.
         '''
 
         self.scope = list(scope)
         self.name = name
-        self.sat_tuples = dict()
-
-        #The next object data item 'sup_tuples' will be used to help
-        #support GAC propgation. It allows access to a list of 
-        #satisfying tuples that contain a particular variable/value
+        self.arity = len(self.scope)
+        self.scope_pos = dict((var, i) for i, var in enumerate(self.scope))
+
+        #'rows' holds the satisfying tuples, nrows rows of arity value
+        #indices. 'codes' holds each row packed into a single int (using
+        #'bits' bits for the value index of each position), and is sorted
+        #on demand so check can binary search it.
+        self.rows = array('i')
+        self.nrows = 0
+        self.bits = None
+        self.codes = array('q')
+        self.codes_sorted = True
+
+        #The next object data item 'sup_rows' will be used to help
+        #support GAC propgation. It maps a (scope position, value index)
+        #pair to the array of the rows containing that variable/value
         #pair.
-        self.sup_tuples = dict()
+        self.sup_rows = dict()
+
+        #'residues' maps a (scope position, value index) pair to the
+        #position in its sup_rows array of the last support found for
+        #it. It is only a hint: has_support checks it first and resumes
+        #its scan from there, but always validates the row against the
+        #current domains, so residues stay correct when values are
+        #restored on backtracking.
+        self.residues = dict()
+
+        #'masks' maps a (scope position, value index) pair to the bitset
+        #of its rows, built on demand by support_masks. 'ct_state' holds
+        #the bitset of valid rows (and the domain sizes it was computed
+        #for) of the Compact-Table propagator during search.
+        self.masks = None
+        self.ct_state = None
+
+        #'weight' counts the dead ends this constraint caused (plus one).
+        #The propagators bump it, and the dom/wdeg heuristic of BT uses it.
+        self.weight = 1
 
     def add_satisfying_tuples(self, tuples):
-        '''We specify the constraint by adding its complete list of satisfying tuples.'''
+        '''We specify the constraint by adding its complete list of satisfying
+           tuples. tuples can be any iterable, e.g. a generator, and is
+           consumed one tuple at a time. Tuples with a value outside the
+           domain of its variable can never be satisfied and are skipped.'''
+        self.masks = None
+        if self.bits is None:
+            self.bits = [max(1, len(var.dom)).bit_length() for var in self.scope]
+            self.new_codes()
         for x in tuples:
-            t = tuple(x)  #ensure we have an immutable tuple
-            if not t in self.sat_tuples:
-                self.sat_tuples[t] = True
-
-            #now put t in as a support for all of the variable values in it
-            for i, val in enumerate(t):
-                var = self.scope[i]
-                if not (var,val) in self.sup_tuples:
-                    self.sup_tuples[(var,val)] = []
-                self.sup_tuples[(var,val)].append(t)
+            idxs = self.encode(x)
+            if idxs is None:
+                continue
+            for i, idx in enumerate(idxs):
+                if idx >> self.bits[i]:
+                    #the domain grew since the codes were laid out
+                    self.bits[i] = idx.bit_length()
+                    self.repack()
+            self.codes.append(self.pack(idxs))
+            self.codes_sorted = False
+            r = self.nrows
+            self.rows.extend(idxs)
+            self.nrows += 1
+
+            #now put the row in as a support for all of the variable values in it
+            for i, idx in enumerate(idxs):
+                sups = self.sup_rows.get((i, idx))
+                if sups is None:
+                    sups = self.sup_rows[(i, idx)] = array('i')
+                sups.append(r)
 
     def get_scope(self):
         '''get list of variables the constraint is over'''
         return list(self.scope)
 
+    def support_masks(self):
+        '''Return a dict mapping each (scope position, value index) pair
+           to the bitset (an int) of the rows containing it'''
+        if self.masks is None:
+            nbytes = (self.nrows + 7) // 8
+            self.masks = dict()
+            for key, sups in self.sup_rows.items():
+                bits = bytearray(nbytes)
+                for r in sups:
+                    bits[r >> 3] |= 1 << (r & 7)
+                self.masks[key] = int.from_bytes(bits, "little")
+        return self.masks
+
+    def trail_undo(self, state):
+        '''Called by Trail.undo: restore the Compact-Table state'''
+        self.ct_state = state
+
     def check(self, vals):
         '''Given list of values, one for each variable in the
            constraints scope, return true if and only if these value
@@ -276,7 +386,20 @@ class Constraint:
            constraints "satisfies" function.  Note the list of values
            are must be ordered in the same order as the list of
            variables in the constraints scope'''
-        return tuple(vals) in self.sat_tuples
+        idxs = self.encode(vals)
+        if idxs is None or self.bits is None:
+            return False
+        for i, idx in enumerate(idxs):
+            if idx >> self.bits[i]:
+                return False
+        if not self.codes_sorted:
+            codes = sorted(self.codes)
+            self.new_codes()
+            self.codes.extend(codes)
+            self.codes_sorted = True
+        code = self.pack(idxs)
+        i = bisect_left(self.codes, code)
+        return i < len(self.codes) and self.codes[i] == code
 
     def get_n_unasgn(self):
         '''return the number of unassigned variables in the constraint's scope'''
@@ -298,12 +421,26 @@ class Constraint:
     def has_support(self, var, val):
         '''Test if a variable value pair has a supporting tuple (a set
            of assignments satisfying the constraint where each value is
-           still in the corresponding variables current domain
+           still in the corresponding variables current domain.
+           The last support found (the residue) is checked first.
         '''
-        if (var, val) in self.sup_tuples:
-            for t in self.sup_tuples[(var, val)]:
-                if self.tuple_is_valid(t):
-                    return True
+        pos = self.scope_pos.get(var)
+        idx = var.dom_index.get(val)
+        if pos is None or idx is None:
+            return False
+        key = (pos, idx)
+        sups = self.sup_rows.get(key)
+        if not sups:
+            return False
+        n = len(sups)
+        start = self.residues.get(key, 0)
+        for k in range(n):
+            i = start + k
+            if i >= n:
+                i -= n
+            if self.row_is_valid(sups[i]):
+                self.residues[key] = i
+                return True
         return False
 
     def tuple_is_valid(self, t):
@@ -314,10 +451,909 @@ class Constraint:
                 return False
         return True
 
+    def row_is_valid(self, r):
+        '''Internal routine. Check if every value of row r is still in
+           corresponding variable domains'''
+        rows = self.rows
+        base = r * self.arity
+        for i, var in enumerate(self.scope):
+            if not var.in_cur_domain_index(rows[base + i]):
+                return False
+        return True
+
+    def encode(self, vals):
+        '''Internal routine. Return the list of domain indices of a tuple
+           of values, None if a value is not in the domain of its variable'''
+        idxs = []
+        for var, val in zip(self.scope, vals):
+            idx = var.dom_index.get(val)
+            if idx is None:
+                return None
+            idxs.append(idx)
+        return idxs
+
+    def pack(self, idxs):
+        '''Internal routine. Pack a list of value indices into one int'''
+        code = 0
+        for i, idx in enumerate(idxs):
+            code = (code << self.bits[i]) | idx
+        return code
+
+    def new_codes(self):
+        '''Internal routine. Return an empty container for the packed
+           rows: an array of 64 bit ints if they fit, else a list'''
+        if sum(self.bits) < 64:
+            self.codes = array('q')
+        else:
+            self.codes = []
+
+    def repack(self):
+        '''Internal routine. Recompute the packed rows after a change of
+           bits'''
+        self.new_codes()
+        k = self.arity
+        for r in range(self.nrows):
+            self.codes.append(self.pack(self.rows[r*k:(r+1)*k]))
+        self.codes_sorted = False
+
+    def forward_check(self, newVar=None):
+        '''Return the (var, val) pairs forward checking should prune.
+           newVar is the most recently assigned variable, or None before
+           any assignments are made. By default only a constraint with a
+           single unassigned variable is checked, and its values without
+           a support are returned.
+
+           For a table, the residue of each value is checked first, and
+           the values whose residue is no longer valid are tested at once
+           against the rows left by the assigned values, using the
+           support masks of Compact-Table.'''
+        if self.get_n_unasgn() != 1:
+            return []
+        var = self.get_unasgn_vars()[0]
+        if not self.extensional:
+            return [(var, val) for val in var.cur_domain()
+                    if not self.has_support(var, val)]
+
+        pos = self.scope_pos[var]
+        valid = None
+        result = []
+        for val in var.cur_domain():
+            idx = var.dom_index[val]
+            key = (pos, idx)
+            sups = self.sup_rows.get(key)
+            if not sups:
+                result.append((var, val))
+                continue
+            if self.row_is_valid(sups[self.residues.get(key, 0)]):
+                continue
+            if valid is None:
+                masks = self.support_masks()
+                valid = (1 << self.nrows) - 1
+                for i, v in enumerate(self.scope):
+                    if v is not var:
+                        valid &= masks.get((i, v.dom_index[v.get_assigned_value()]), 0)
+            rows = valid & masks.get(key, 0)
+            if rows:
+                r = (rows & -rows).bit_length() - 1
+                self.residues[key] = bisect_left(sups, r)
+            else:
+                result.append((var, val))
+        return result
+
+    #True if the constraint is specified by its table of satisfying
+    #tuples (used by prop_CT).
+    extensional = True
+
+    #True if get_unsupported filters the whole scope at once (global
+    #constraints). GAC then revises the constraint as a whole instead of
+    #revising it variable by variable.
+    whole_scope = False
+
+    def get_unsupported(self, vars=None):
+        '''Generate the (var, val) pairs of vars (default the whole scope)
+           that have no support, for GAC propagation. Values are tested
+           lazily, so prunings made by the caller while iterating are taken
+           into account. Constraints with a dedicated filtering algorithm
+           override this.'''
+        if vars is None:
+            vars = self.scope
+        for var in vars:
+            for val in var.cur_domain():
+                if not self.has_support(var, val):
+                    yield (var, val)
+
     def __str__(self):
         return("{}({})".format(self.name,[var.name for var in self.scope]))
 
 
+class FunctionConstraint(Constraint):
+    '''Constraint specified by a check function instead of a table of
+       satisfying tuples (an intensional constraint).  Model construction
+       costs nothing beyond storing the function, so large scopes with
+       large domains no longer have to be enumerated up front.'''
+
+    extensional = False
+
+    def __init__(self, name, scope, check_fn, support_fn=None):
+        '''create a constraint object, specify the constraint name (a
+        string), its scope (an ORDERED list of variable objects) and
+        check_fn, a function taking a list of values (one for each
+        variable in the scope, in the same order) and returning True iff
+        they satisfy the constraint.
+
+        support_fn is optional. If given it is called as
+        support_fn(constraint, var, val) and must return True iff val of
+        var has a support among the current domains of the other
+        variables in the scope. Without it has_support falls back to
+        enumerating the current domains, which is exponential in the
+        size of the scope.
+        '''
+        Constraint.__init__(self, name, scope)
+        self.check_fn = check_fn
+        self.support_fn = support_fn
+
+    def add_satisfying_tuples(self, tuples):
+        '''Intensional constraints have no table of tuples.'''
+        print("Trying to add satisfying tuples to function constraint ", self)
+
+    def check(self, vals):
+        '''Apply the check function to the list of values'''
+        return self.check_fn(list(vals))
+
+    def has_support(self, var, val):
+        '''Test if a variable value pair has a supporting assignment
+           to the other variables of the scope using their current
+           domains'''
+        if not var.in_cur_domain(val):
+            return False
+        if self.support_fn:
+            return self.support_fn(self, var, val)
+        doms = []
+        for v in self.scope:
+            if v is var:
+                doms.append([val])
+            else:
+                doms.append(v.cur_domain())
+        for t in itertools.product(*doms):
+            if self.check_fn(list(t)):
+                return True
+        return False
+
+
+
+class AllDiffConstraint(Constraint):
+    '''Constraint requiring the variables of the scope to take pairwise
+       different values. GAC filtering uses the bipartite matching
+       algorithm of Regin (1994), which removes every value that
+       belongs to no maximum matching between variables and values.
+
+       A cheaper bounds consistency mode is available. It orders the
+       values by key, sees the domain of each variable as the interval
+       between its smallest and largest value, and only tightens those
+       bounds, using the Hall interval algorithm of Lopez-Ortiz, Quimper,
+       Tromp and van Beek (2003) in O(n log n).'''
+
+    extensional = False
+
+    def __init__(self, name, scope, mode="gac", key=None):
+        '''create a constraint object, specify the constraint name (a
+        string) and its scope (a list of variable objects).
+
+        mode is "gac" for matching based filtering or "bounds" for
+        bounds consistency. key is an optional function mapping values
+        to comparable keys, used to order the values in bounds mode.
+        '''
+        Constraint.__init__(self, name, scope)
+        self.mode = mode
+        self.key = key
+        #last matching found, reused as a starting point next time
+        self.matching = dict()
+
+    def add_satisfying_tuples(self, tuples):
+        '''The satisfying tuples of an all different constraint are 
+           implicit.'''
+        print("Trying to add satisfying tuples to all different constraint ", self)
+
+    def check(self, vals):
+        '''All values must be different'''
+        return len(set(vals)) == len(vals)
+
+    def has_support(self, var, val):
+        '''val of var is supported iff there is a matching covering
+           the scope that matches var to val'''
+        if not var.in_cur_domain(val):
+            return False
+        doms = self.cur_domains()
+        doms[self.scope.index(var)] = [val]
+        return len(self.max_matching(doms, dict())) == len(self.scope)
+
+    def forward_check(self, newVar=None):
+        '''Remove the values of assigned variables from the current
+           domains of the unassigned ones. This is stronger than checking
+           the constraint when one variable is left. Before any
+           assignment, if two assigned variables share a value, the values
+           of an unassigned variable are returned so that the propagator
+           fails.'''
+        unassigned = self.get_unasgn_vars()
+        if newVar is None:
+            taken = [v.get_assigned_value() for v in self.scope if v.is_assigned()]
+            if unassigned and len(set(taken)) != len(taken):
+                var = unassigned[0]
+                return [(var, val) for val in var.cur_domain()]
+        else:
+            taken = [newVar.get_assigned_value()]
+        pruned = []
+        seen = set()
+        for var in unassigned:
+            for val in taken:
+                if var.in_cur_domain(val) and not (var, val) in seen:
+                    seen.add((var, val))
+                    pruned.append((var, val))
+        return pruned
+
+    whole_scope = True
+
+    def get_unsupported(self, vars=None):
+        '''Return the (var, val) pairs of the scope that have no support.
+           If the constraint cannot be satisfied at all, every value of an
+           unassigned variable is returned so the propagator fails. The
+           whole scope is always filtered, vars is ignored.'''
+        if self.mode == "bounds":
+            result = self.bounds_unsupported()
+        else:
+            result = self.regin_unsupported()
+        if result is None:
+            unasgn = self.get_unasgn_vars()
+            if not unasgn:
+                return []
+            return [(unasgn[0], val) for val in unasgn[0].cur_domain()]
+        return result
+
+    #
+    #internal methods
+    #
+
+    def cur_domains(self):
+        '''list of the current domains of the scope'''
+        return [var.cur_domain() for var in self.scope]
+
+    def max_matching(self, doms, matching):
+        '''Compute a maximum matching between variable positions and
+           values, starting from matching (position -> value), using
+           augmenting paths. Returns the matching as a dict.'''
+        match_var = dict()   #value -> position
+        for i, val in list(matching.items()):
+            if i < len(doms) and val in doms[i] and not val in match_var:
+                match_var[val] = i
+            else:
+                del matching[i]
+
+        for root in range(len(doms)):
+            if root in matching:
+                continue
+            #breadth first search for an augmenting path from root
+            parent = {root: None}  #position -> value it was reached through
+            queue = [root]
+            free_val = None
+            while queue and free_val is None:
+                nxt = []
+                for i in queue:
+                    for val in doms[i]:
+                        j = match_var.get(val)
+                        if j is None:
+                            free_val = (i, val)
+                            break
+                        if not j in parent:
+                            parent[j] = (i, val)
+                            nxt.append(j)
+                    if free_val is not None:
+                        break
+                queue = nxt
+            if free_val is None:
+                continue
+            #flip the path
+            i, val = free_val
+            while True:
+                matching[i] = val
+                match_var[val] = i
+                if parent[i] is None:
+                    break
+                i, val = parent[i]
+        return matching
+
+    def regin_unsupported(self):
+        '''Regin's filtering. Returns None if no matching covers the
+           scope.'''
+        doms = self.cur_domains()
+        n = len(doms)
+        matching = self.max_matching(doms, self.matching)
+        self.matching = matching
+        if len(matching) < n:
+            return None
+
+        #Nodes 0..n-1 are variables, values get ids from n on. Matched
+        #edges go from variable to value, the others from value to variable.
+        val_id = dict()
+        for d in doms:
+            for val in d:
+                if not val in val_id:
+                    val_id[val] = n + len(val_id)
+        succ = [[] for i in range(n + len(val_id))]
+        for i, d in enumerate(doms):
+            for val in d:
+                if matching[i] == val:
+                    succ[i].append(val_id[val])
+                else:
+                    succ[val_id[val]].append(i)
+
+        #Edges on an alternating path from a free value are consistent
+        matched_vals = set(matching.values())
+        reached = [False] * len(succ)
+        stack = [val_id[val] for val in val_id if not val in matched_vals]
+        for u in stack:
+            reached[u] = True
+        while stack:
+            u = stack.pop()
+            for w in succ[u]:
+                if not reached[w]:
+                    reached[w] = True
+                    stack.append(w)
+
+        comp = strongly_connected_components(succ)
+        result = []
+        for i, d in enumerate(doms):
+            var = self.scope[i]
+            if var.is_assigned():
+                continue
+            for val in d:
+                u = val_id[val]
+                if matching[i] != val and not reached[u] and comp[u] != comp[i]:
+                    result.append((var, val))
+        return result
+
+    def bounds_unsupported(self):
+        '''Bounds consistency through Hall intervals. Returns None if 
+           some interval holds more variables than values.'''
+        key = self.key if self.key else (lambda x: x)
+        doms = self.cur_domains()
+        if any(not d for d in doms):
+            return None
+        vals = sorted(set(val for d in doms for val in d), key=key)
+        rank = dict((val, r) for r, val in enumerate(vals))
+        lo = [min(rank[val] for val in d) for d in doms]
+        hi = [max(rank[val] for val in d) for d in doms]
+
+        if not hall_filter(lo, hi, True) or not hall_filter(lo, hi, False):
+            return None
+
+        result = []
+        for i, d in enumerate(doms):
+            var = self.scope[i]
+            if var.is_assigned():
+                continue
+            for val in d:
+                if not lo[i] <= rank[val] <= hi[i]:
+                    result.append((var, val))
+        return result
+
+
+def hall_filter(lo, hi, lower):
+    '''Bounds consistency of all different over the integer intervals
+       [lo[i], hi[i]] (Lopez-Ortiz et al., 2003): if lower, raise each lo
+       past the Hall intervals below it, else lower each hi. The bounds
+       are updated in place. Returns False if some interval holds more
+       variables than values.
+
+       The upper bounds are handled by mirroring the intervals, so only
+       the lower bound pass is implemented.'''
+    n = len(lo)
+    if not n:
+        return True
+    if lower:
+        mins, maxs = lo, [h + 1 for h in hi]
+    else:
+        mins, maxs = [-h for h in hi], [1 - l for l in lo]
+    minsorted = sorted(range(n), key=lambda i: mins[i])
+    maxsorted = sorted(range(n), key=lambda i: maxs[i])
+
+    #merge the sorted bounds into 'bounds', and rank each interval
+    bounds = [0] * (2 * n + 2)
+    minrank = [0] * n
+    maxrank = [0] * n
+    nb = 0
+    last = bounds[0] = mins[minsorted[0]] - 2
+    i = j = 0
+    while j < n:
+        if i < n and mins[minsorted[i]] <= maxs[maxsorted[j]]:
+            if mins[minsorted[i]] != last:
+                nb = nb + 1
+                last = bounds[nb] = mins[minsorted[i]]
+            minrank[minsorted[i]] = nb
+            i = i + 1
+        else:
+            if maxs[maxsorted[j]] != last:
+                nb = nb + 1
+                last = bounds[nb] = maxs[maxsorted[j]]
+            maxrank[maxsorted[j]] = nb
+            j = j + 1
+    bounds[nb + 1] = bounds[nb] + 2
+
+    #t links the bound ranks to the next one with free capacity d, h
+    #links the ranks inside a Hall interval to its upper end
+    t = [i - 1 for i in range(nb + 2)]
+    h = list(t)
+    d = [0] + [bounds[i] - bounds[i - 1] for i in range(1, nb + 2)]
+    for v in maxsorted:
+        x, y = minrank[v], maxrank[v]
+        z = path_max(t, x + 1)
+        j = t[z]
+        d[z] = d[z] - 1
+        if d[z] == 0:
+            t[z] = z + 1
+            z = path_max(t, t[z])
+            t[z] = j
+        path_set(t, x + 1, z, z)
+        if d[z] < bounds[z] - bounds[y]:
+            return False
+        if h[x] > x:
+            w = path_max(h, h[x])
+            if lower:
+                lo[v] = bounds[w]
+            else:
+                hi[v] = -bounds[w]
+            path_set(h, x, w, w)
+        if d[z] == bounds[z] - bounds[y]:
+            path_set(h, h[y], j - 1, y)
+            h[y] = j - 1
+    return True
+
+
+def path_max(a, x):
+    '''Follow the links of a from x up to a rank linked to itself or below'''
+    while a[x] > x:
+        x = a[x]
+    return x
+
+
+def path_set(a, start, end, to):
+    '''Link every rank on the path of a from start to end to rank to'''
+    k = start
+    while k != end:
+        nxt = a[k]
+        a[k] = to
+        k = nxt
+
+
+class PrecedenceConstraint(Constraint):
+    '''Constraint requiring the values of the variables in before to
+       end before the value of the variable after starts. Filtering
+       works on bounds only: the earliest end of each variable in
+       before against the latest start of after. For this constraint
+       bounds reasoning is enough for GAC, and costs one pass over the
+       current domains.'''
+
+    extensional = False
+
+    def __init__(self, name, before, after, start=None, end=None):
+        '''create a constraint object, specify the constraint name (a
+        string), the list of variables that must come first and the
+        variable that must come after them. The scope is before + [after].
+
+        start and end are optional functions mapping a value to its
+        (comparable) start and end. By default the value itself is used
+        for both.
+        '''
+        Constraint.__init__(self, name, list(before) + [after])
+        self.before = list(before)
+        self.after = after
+        self.start = start if start else (lambda x: x)
+        self.end = end if end else (lambda x: x)
+
+    def add_satisfying_tuples(self, tuples):
+        '''The satisfying tuples of a precedence constraint are implicit.'''
+        print("Trying to add satisfying tuples to precedence constraint ", self)
+
+    def check(self, vals):
+        '''Every value of before must end before the value of after starts'''
+        vals = list(vals)
+        s = self.start(vals[-1])
+        for val in vals[:-1]:
+            if not self.end(val) < s:
+                return False
+        return True
+
+    def has_support(self, var, val):
+        '''Compare val with the latest start of after, or the earliest
+           ends of before'''
+        if not var.in_cur_domain(val):
+            return False
+        if any(v.cur_domain_size() == 0 for v in self.scope):
+            return False
+        if var is self.after:
+            return self.ends_before(self.earliest_end(), self.start(val))
+        latest = self.latest_start()
+        if not self.end(val) < latest:
+            return False
+        return self.ends_before(self.earliest_end(var), latest)
+
+    def forward_check(self, newVar=None):
+        '''Prune against the assigned variables of the scope'''
+        pruned = []
+        if self.after.is_assigned():
+            s = self.start(self.after.get_assigned_value())
+            for var in self.before:
+                if not var.is_assigned():
+                    pruned.extend((var, val) for val in var.cur_domain()
+                                  if not self.end(val) < s)
+        else:
+            ends = [self.end(var.get_assigned_value()) 
+                    for var in self.before if var.is_assigned()]
+            if ends:
+                e = max(ends)
+                pruned.extend((self.after, val) for val in self.after.cur_domain()
+                              if not e < self.start(val))
+        return pruned
+
+    whole_scope = True
+
+    def get_unsupported(self, vars=None):
+        '''Bounds filtering. Values of after must start after the 
+           earliest end of every variable in before, values of before 
+           must end before the latest start of after. The whole scope is
+           always filtered, vars is ignored.'''
+        if any(var.cur_domain_size() == 0 for var in self.scope):
+            return []
+        e = self.earliest_end()
+        pruned = [(self.after, val) for val in self.after.cur_domain()
+                  if not self.ends_before(e, self.start(val))]
+        if len(pruned) == self.after.cur_domain_size():
+            return pruned
+        latest = max(self.start(val) for val in self.after.cur_domain()
+                     if self.ends_before(e, self.start(val)))
+        for var in self.before:
+            pruned.extend((var, val) for val in var.cur_domain()
+                          if not self.end(val) < latest)
+        return pruned
+
+    #
+    #internal methods
+    #
+
+    def earliest_end(self, skip=None):
+        '''The latest of the earliest ends of the variables in before
+           (other than skip), i.e., the earliest time at which all of
+           them can be done. None if there is none to wait for.'''
+        e = None
+        for var in self.before:
+            if var is skip:
+                continue
+            ee = min(self.end(val) for val in var.cur_domain())
+            if e is None or e < ee:
+                e = ee
+        return e
+
+    def latest_start(self):
+        '''The latest start of after'''
+        return max(self.start(val) for val in self.after.cur_domain())
+
+    def ends_before(self, e, s):
+        '''Compare an earliest end (None if there is nothing to wait for)
+           with a start'''
+        return e is None or e < s
+
+
+class CumulativeConstraint(Constraint):
+    '''Resource constraint. Each value is a tuple of resources (e.g.,
+       the Slots of a task) all used by the variable taking it. A
+       resource can be used by a set of variables A only if
+       len(A) <= min(limit(v) for v in A), e.g., a Slot can hold as many
+       tasks as the smallest multi among them.
+
+       Resources must keep the variables whose assigned value uses them
+       in an 'assigned' collection, as Slot does (Variable.assign
+       registers the variable with every resource of its value).
+
+       Filtering is timetable based. A variable uses a resource
+       compulsorily if every value left in its current domain contains
+       it (in particular if it is assigned). Values that would overload
+       a resource given the compulsory usage of the other variables are
+       pruned. has_support uses the same relaxation, so it is not full
+       GAC.
+
+       During search the timetable is kept between calls (see
+       timetable): only the variables whose domain shrank are updated,
+       and only the resources they now use compulsorily are filtered.'''
+
+    extensional = False
+
+    def __init__(self, name, scope, limit=None):
+        '''create a constraint object, specify the constraint name (a
+        string) and its scope (a list of variable objects). limit is an
+        optional function returning how many variables (itself included)
+        a variable tolerates on a resource. By default it is the multi of
+        the variable's task.
+        '''
+        Constraint.__init__(self, name, scope)
+        self.limit = limit if limit else (lambda var: var.task.multi)
+        #resource -> [(var, val)] of the values using it, resource ->
+        #smallest limit among those variables, and var -> limit, built on
+        #demand
+        self.users = None
+        self.min_limit = None
+        self.limits = None
+        #the timetable kept during search: the domain size and compulsory
+        #resources of each variable of the scope, and the load of each
+        #resource (resource -> set of variables)
+        self.tt = None
+
+    def add_satisfying_tuples(self, tuples):
+        '''The satisfying tuples of a cumulative constraint are implicit.'''
+        print("Trying to add satisfying tuples to cumulative constraint ", self)
+
+    def check(self, vals):
+        '''No resource may be used by more variables than the smallest
+           limit among them'''
+        load = dict()
+        for var, val in zip(self.scope, vals):
+            for r in val:
+                load.setdefault(r, []).append(var)
+        for vs in load.values():
+            if len(vs) > min(self.limit(v) for v in vs):
+                return False
+        return True
+
+    def has_support(self, var, val):
+        '''val of var is supported if no resource of val is overloaded
+           by the compulsory usage of the other variables and var'''
+        if not var.in_cur_domain(val):
+            return False
+        load = self.compulsory_load()
+        if load is None:
+            return False
+        for r in val:
+            vs = [v for v in load.get(r, []) if v is not var]
+            if vs and len(vs) + 1 > min(min(self.limit(v) for v in vs), 
+                                        self.limit(var)):
+                return False
+        return True
+
+    def forward_check(self, newVar=None):
+        '''Prune the values of unassigned variables using a resource the
+           assigned variables leave no room on. Only the resources of
+           newVar are checked (all of them before any assignment).'''
+        if newVar is None:
+            if all(v.is_assigned() for v in self.scope):
+                return []
+            resources = set(r for v in self.scope if v.is_assigned() 
+                            for r in v.get_assigned_value())
+        elif newVar in self.scope_pos:
+            resources = newVar.get_assigned_value()
+        else:
+            return []
+        load = dict()
+        for r in resources:
+            load[r] = [v for v in r.assigned if v in self.scope_pos]
+        return self.overloaded(load)
+
+    whole_scope = True
+
+    def get_unsupported(self, vars=None):
+        '''Timetable filtering over the whole scope, vars is ignored. If
+           the compulsory usage already overloads a resource, the values
+           of the first variable of the scope are returned so that the
+           propagator fails.'''
+        trail = self.scope[0].trail if self.scope else None
+        if trail is None:
+            load = self.compulsory_load()
+        else:
+            load = self.timetable(trail)
+        if load is None:
+            var = self.scope[0]
+            return [(var, val) for val in var.cur_domain()]
+        return self.overloaded(load)
+
+    def rescoped(self, removed=[], added=[]):
+        '''Return a CumulativeConstraint with the same name and limit,
+           over the scope without the variables removed and with the
+           variables added. Its resource index is updated from the one of
+           this constraint, so the cost is in the size of the domains of
+           removed and added rather than of the whole scope. The smallest
+           limit of a resource is not raised when its variables are
+           removed: it stays a lower bound, which only makes overloaded
+           skip fewer resources.'''
+        removed = set(removed)
+        c = CumulativeConstraint(self.name, 
+            [v for v in self.scope if not v in removed] + list(added), 
+            self.limit)
+        if self.users is None:
+            return c
+        c.users = dict(self.users)
+        c.limits = dict(self.limits)
+        c.min_limit = dict(self.min_limit)
+        touched = set()
+        for var in removed:
+            del c.limits[var]
+            touched.update(r for val in var.dom for r in val)
+        for r in touched:
+            c.users[r] = [u for u in c.users[r] if not u[0] in removed]
+        for var in added:
+            lim = c.limits[var] = self.limit(var)
+            for idx, val in enumerate(var.domain()):
+                for r in val:
+                    if not r in touched:
+                        touched.add(r)
+                        c.users[r] = list(c.users.get(r, []))
+                    c.users[r].append((var, val, idx))
+                    c.min_limit[r] = min(lim, c.min_limit.get(r, lim))
+        return c
+
+    #
+    #internal methods
+    #
+
+    def get_users(self, r):
+        '''list of the (var, val, index of val) of the scope whose value
+           uses resource r'''
+        if self.users is None:
+            self.users = dict()
+            self.min_limit = dict()
+            self.limits = dict()
+            for var in self.scope:
+                lim = self.limits[var] = self.limit(var)
+                for idx, val in enumerate(var.domain()):
+                    for res in val:
+                        self.users.setdefault(res, []).append((var, val, idx))
+                        self.min_limit[res] = min(lim, 
+                            self.min_limit.get(res, lim))
+        return self.users.get(r, [])
+
+    def trail_undo(self, data):
+        '''Called by Trail.undo: restore the timetable entry of a
+           variable, or drop the timetable if data is None'''
+        if data is None:
+            self.tt = None
+            return
+        pos, size, comp = data
+        sizes, comps, load = self.tt
+        var = self.scope[pos]
+        for r in comps[pos] - comp:
+            load[r].discard(var)
+        for r in comp - comps[pos]:
+            load.setdefault(r, set()).add(var)
+        sizes[pos] = size
+        comps[pos] = comp
+
+    def compulsory(self, var):
+        '''the set of resources used by every value in the current
+           domain of var'''
+        if var.is_assigned():
+            return frozenset(var.get_assigned_value())
+        common = None
+        for val in itertools.compress(var.dom, var.curdom):
+            if common is None:
+                common = set(val)
+            else:
+                common.intersection_update(val)
+            if not common:
+                break
+        return frozenset(common) if common else frozenset()
+
+    def compulsory_load(self):
+        '''Map each resource to the variables using it compulsorily.
+           Returns None if a resource is overloaded.'''
+        load = dict()
+        for var in self.scope:
+            for r in self.compulsory(var):
+                load.setdefault(r, []).append(var)
+        for vs in load.values():
+            if len(vs) > 1 and len(vs) > min(self.limit(v) for v in vs):
+                return None
+        return load
+
+    def timetable(self, trail):
+        '''compulsory_load for search, updated from the variables whose
+           domain size changed since the last call. Each change is logged
+           in trail, so backtracking restores the timetable with the
+           domains. Returns the load of the resources that gained
+           compulsory users (all of them on the first call), or None if
+           one of them is overloaded.'''
+        if self.tt is None:
+            self.tt = ([-1] * self.arity, [frozenset()] * self.arity, dict())
+            trail.push(self, None)
+        sizes, comps, load = self.tt
+        changed = dict()
+        for pos, var in enumerate(self.scope):
+            #cur_domain_size, inlined as this loop runs on every call
+            size = 1 if var.assignedValue is not None else var.curdom_size
+            if size == sizes[pos]:
+                continue
+            comp = self.compulsory(var)
+            trail.push(self, (pos, sizes[pos], comps[pos]))
+            for r in comps[pos] - comp:
+                load[r].discard(var)
+            for r in comp - comps[pos]:
+                vs = changed[r] = load.setdefault(r, set())
+                vs.add(var)
+            sizes[pos] = size
+            comps[pos] = comp
+        for vs in changed.values():
+            if len(vs) > 1 and len(vs) > min(self.limit(v) for v in vs):
+                return None
+        return changed
+
+    def overloaded(self, load):
+        '''Return the (var, val) pairs of unassigned variables that do not
+           fit on a resource of load (resource -> variables using it)'''
+        self.get_users(None)
+        limits = self.limits
+        pruned = []
+        seen = set()
+        for r, vs in load.items():
+            n = len(vs)
+            if not n:
+                continue
+            m = min(limits[v] for v in vs)
+            if m > n and self.min_limit[r] > n:
+                #every other user still fits
+                continue
+            for var, val, idx in self.users[r]:
+                if var.assignedValue is None and var.curdom[idx] \
+                        and (m <= n or limits[var] <= n) and not var in vs \
+                        and not (var, val) in seen:
+                    seen.add((var, val))
+                    pruned.append((var, val))
+        return pruned
+
+
+def strongly_connected_components(succ):
+    '''Label the nodes 0..len(succ)-1 of a directed graph, given by
+       successor lists, with the id of their strongly connected
+       component (iterative version of Tarjan's algorithm).'''
+    n = len(succ)
+    index = [-1] * n
+    low = [0] * n
+    comp = [-1] * n
+    on_stack = [False] * n
+    stack = []
+    counter = 0
+    ncomp = 0
+    for root in range(n):
+        if index[root] >= 0:
+            continue
+        work = [(root, 0)]
+        while work:
+            u, k = work.pop()
+            if k == 0:
+                index[u] = low[u] = counter
+                counter += 1
+                stack.append(u)
+                on_stack[u] = True
+            elif k > 0:
+                w = succ[u][k-1]
+                low[u] = min(low[u], low[w])
+            recurse = False
+            while k < len(succ[u]):
+                w = succ[u][k]
+                k += 1
+                if index[w] < 0:
+                    work.append((u, k))
+                    work.append((w, 0))
+                    recurse = True
+                    break
+                elif on_stack[w]:
+                    low[u] = min(low[u], index[w])
+            if recurse:
+                continue
+            if low[u] == index[u]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    comp[w] = ncomp
+                    if w == u:
+                        break
+                ncomp += 1
+    return comp
+
 
 class CSP:
     '''Class for packing up a set of variables into a CSP problem.
@@ -333,24 +1369,34 @@ class CSP:
         self.vars = []
         self.cons = []
         self.vars_to_cons = dict()
+        #Trail recording the changes made during search (set by bt_search).
+        #Propagators need not return their prunings while it is set.
+        self.trail = None
+        #True while BT only tries a value out (see BT.lcv_cost), so the
+        #dead ends found are not counted in the constraint weights.
+        self.probing = False
         for v in vars:
             self.add_var(v)
 
-    def add_var(self,v):
+    def add_var(self, v, pos=None):
         '''Add variable object to CSP while setting up an index
-           to obtain the constraints over this variable'''
+           to obtain the constraints over this variable. It is inserted
+           at index pos of the variables if given, else appended.'''
         if not type(v) is Variable:
             print("Trying to add non variable ", v, " to CSP object")
         elif v in self.vars_to_cons:
             print("Trying to add variable ", v, " to CSP object that already has it")
         else:
-            self.vars.append(v)
+            if pos is None:
+                self.vars.append(v)
+            else:
+                self.vars.insert(pos, v)
             self.vars_to_cons[v] = []
 
     def add_constraint(self,c):
         '''Add constraint to CSP. Note that all variables in the 
            constraints scope must already have been added to the CSP'''
-        if not type(c) is Constraint:
+        if not isinstance(c, Constraint):
             print("Trying to add non constraint ", c, " to CSP object")
         else:
             for v in c.scope:
@@ -360,6 +1406,26 @@ class CSP:
                 self.vars_to_cons[v].append(c)
             self.cons.append(c)
 
+    def remove_constraint(self, c):
+        '''Remove constraint from CSP'''
+        if not c in self.cons:
+            print("Trying to remove constraint ", c, " not in CSP object")
+            return
+        self.cons.remove(c)
+        for v in c.scope:
+            self.vars_to_cons[v].remove(c)
+
+    def remove_var(self, v):
+        '''Remove variable from CSP. The constraints over it must have
+           been removed first'''
+        if not v in self.vars_to_cons:
+            print("Trying to remove variable ", v, " not in CSP object")
+        elif self.vars_to_cons[v]:
+            print("Trying to remove variable ", v, " that still has constraints")
+        else:
+            self.vars.remove(v)
+            del self.vars_to_cons[v]
+
     def get_all_cons(self):
         '''return list of all constraints in the CSP'''
         return self.cons
@@ -384,10 +1450,198 @@ class CSP:
             print(v, " = ", v.get_assigned_value(), "    ")
         print("")
 
+class MRVQueue:
+    '''Priority queue of unassigned variables ordered by current domain
+       size (minimum remaining values), ties broken by the order of the
+       variables given on initialization.
+
+       Variables in the queue notify it whenever their current domain
+       changes. Each notification pushes a new heap entry and outdated
+       entries are discarded when they reach the top, so updates and
+       extraction are O(log n).'''
+
+    def __init__(self, vars=[]):
+        '''vars == all variables that may be put in the queue, in tie
+           breaking order'''
+        self.rank = dict((v, i) for i, v in enumerate(vars))
+        self.heap = []
+        self.members = set()
+
+    def push(self, var):
+        '''Add var to the queue'''
+        if not var in self.members:
+            self.members.add(var)
+            var.queue = self
+            self.update(var)
+
+    def update(self, var):
+        '''Called by var when the size of its current domain changed'''
+        if var in self.members:
+            heapq.heappush(self.heap, (var.cur_domain_size(), self.rank[var], var))
+            if len(self.heap) > 4 * len(self.members) + 64:
+                self.compact()
+
+    def pop(self):
+        '''Remove and return the variable with the smallest current domain'''
+        while self.heap:
+            size, rank, var = heapq.heappop(self.heap)
+            if var in self.members and size == var.cur_domain_size():
+                self.members.remove(var)
+                return var
+        return None
+
+    def remove(self, var):
+        '''Remove var from the queue'''
+        self.members.discard(var)
+
+    def clear(self):
+        '''Empty the queue and stop listening to its variables'''
+        for var in self.rank:
+            if var.queue is self:
+                var.queue = None
+        self.members = set()
+        self.heap = []
+
+    def compact(self):
+        '''Rebuild the heap without outdated entries'''
+        self.heap = [(v.cur_domain_size(), self.rank[v], v) for v in self.members]
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, var):
+        return var in self.members
+
+    def __iter__(self):
+        return iter(sorted(self.members, key=lambda v: self.rank[v]))
+
+
+class Trail:
+    '''Log of changes to reversible search state (e.g., prunings of
+       variable values) so they can be undone in reverse order.
+
+       Each entry is a pair (owner, data); undoing it calls
+       owner.trail_undo(data). level() returns a checkpoint and
+       undo(level) rewinds every change made after it, so backtracking
+       does not need the lists of prunings returned by propagators.'''
+
+    def __init__(self):
+        self.entries = []
+        self.nPrunings = 0  #number of variable values pruned so far
+
+    def level(self):
+        '''Return a checkpoint to undo to'''
+        return len(self.entries)
+
+    def push(self, owner, data):
+        '''Log a change of owner, undone by owner.trail_undo(data)'''
+        self.entries.append((owner, data))
+
+    def push_pruning(self, var, i):
+        '''Log the pruning of the i-th domain value of var'''
+        self.entries.append((var, i))
+        self.nPrunings += 1
+
+    def undo(self, level):
+        '''Undo every change logged after checkpoint level'''
+        entries = self.entries
+        while len(entries) > level:
+            owner, data = entries.pop()
+            owner.trail_undo(data)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Objective(abc.ABC):
+    '''Abstract base class of the functions of an assignment that BT can
+       minimize by branch and bound (see BT.set_objective). Subclasses
+       must implement value, and should implement lower_bound and prune so
+       the search can cut branches that cannot improve on the best
+       solution found.'''
+
+    def __init__(self, name):
+        self.name = name
+
+    @abc.abstractmethod
+    def value(self, csp):
+        '''Return the cost of the current assignment of all the variables
+           of csp'''
+
+    def lower_bound(self, csp):
+        '''Return a lower bound of the cost of every complete assignment
+           extending the current one within the current domains'''
+        return 0
+
+    def prune(self, csp, bound):
+        '''Return the (var, val) pairs of unassigned variables and values
+           of their current domains such that no complete assignment
+           with var = val costs less than bound'''
+        return []
+
+    def __str__(self):
+        return "Objective-{}".format(self.name)
+
+
 ########################################################
 # Backtracking Routine                                 #
 ########################################################
 
+def luby(i):
+    '''Return the i-th term (i >= 1) of the Luby sequence
+       1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ...'''
+    k = 1
+    while (1 << k) - 1 < i:
+        k = k + 1
+    while (1 << k) - 1 != i:
+        i = i - (1 << (k - 1)) + 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k = k + 1
+    return 1 << (k - 1)
+
+
+class SearchResult:
+    '''Outcome of a search returned by BT.bt_search:
+       status     == SOLVED, UNSAT or UNKNOWN (a search limit was reached)
+       assignment == dict mapping each variable to its value. If UNKNOWN
+                     it is the deepest partial assignment found, if
+                     UNSAT it is empty
+       cpu_time, wall_time == time used by the search in seconds
+       nDecisions, nPrunings == the search statistics (see BT)
+       cost       == cost of the assignment if the search minimized an
+                     objective, else None
+       optimal    == True if the search minimized an objective and proved
+                     no assignment costs less'''
+
+    SOLVED = "solved"
+    UNSAT = "unsat"
+    UNKNOWN = "unknown"
+
+    def __init__(self, status, assignment, cpu_time, wall_time, 
+                 nDecisions, nPrunings, cost=None, optimal=False):
+        self.status = status
+        self.cost = cost
+        self.optimal = optimal
+        self.assignment = assignment
+        self.cpu_time = cpu_time
+        self.wall_time = wall_time
+        self.nDecisions = nDecisions
+        self.nPrunings = nPrunings
+
+    def is_solved(self):
+        return self.status == SearchResult.SOLVED
+
+    def __repr__(self):
+        cost = ""
+        if self.cost is not None:
+            cost = ", cost={}{}".format(self.cost, " (optimal)" if self.optimal else "")
+        return("SearchResult({}, {} assigned{}, cpu={:.4f}s, decisions={}, prunings={})".format(
+            self.status, len(self.assignment), cost, self.cpu_time, 
+            self.nDecisions, self.nPrunings))
+
+
 class BT:
     '''use a class to encapsulate things like statistics
        and bookeeping for pruning/unpruning variabel domains
@@ -404,9 +1658,26 @@ class BT:
         self.nDecisions = 0 #nDecisions is the number of variable 
                             #assignments made during search
         self.nPrunings  = 0 #nPrunings is the number of value prunings during search
-        unasgn_vars = list() #used to track unassigned variables
+        self.unasgn_vars = MRVQueue() #used to track unassigned variables
+        self.trail = Trail()          #used to undo prunings on backtracking
         self.TRACE = False
         self.runtime = 0
+        self.partial = dict() #deepest partial assignment of the last search
+        self.open_nodes = []  #subtrees it left unexplored
+        self.start_cpu = 0    #start times of the current search
+        self.start_wall = 0
+        self.nRestarts = 0
+        self.nSolutions = 0   #solutions found by branch and bound
+        self.best = None      #best assignment found by branch and bound
+        self.best_cost = None #and its cost
+        self.objective = None
+        self.bound = None     #initial bound of branch and bound
+        self.fixed = dict()   #assignments kept during the searches
+        self.hints = dict()   #values tried first during the searches
+        self.set_limits()
+        self.set_restarts()
+        self.set_var_heuristic()
+        self.set_value_order()
 
     def trace_on(self):
         '''Turn search trace on'''
@@ -421,11 +1692,17 @@ class BT:
         '''Initialize counters'''
         self.nDecisions = 0
         self.nPrunings = 0
+        self.nRestarts = 0
+        self.nSolutions = 0
         self.runtime = 0
 
     def print_stats(self):
         print("Search made {} variable assignments and pruned {} variable values".format(
             self.nDecisions, self.nPrunings))
+        if self.nRestarts:
+            print("Search restarted {} times".format(self.nRestarts))
+        if self.objective is not None:
+            print("Search found {} improving solutions".format(self.nSolutions))
 
     def restoreValues(self,prunings):
         '''Restore list of values to variable domains
@@ -433,6 +1710,54 @@ class BT:
         for var, val in prunings:
             var.unprune_value(val)
 
+    def attach_trail(self):
+        '''Start logging the changes made to the CSP in a new trail'''
+        self.trail = Trail()
+        self.csp.trail = self.trail
+        for var in self.csp.vars:
+            var.trail = self.trail
+
+    def detach_trail(self):
+        '''Stop logging changes made to the CSP'''
+        self.csp.trail = None
+        for var in self.csp.vars:
+            var.trail = None
+
+    def propagate(self, propagator, var=None):
+        '''Run the propagator, counting the values it pruned. Prunings
+           are logged in the trail, so the list it returns is only used
+           for tracing.'''
+        count = self.trail.nPrunings
+        status, prunings = propagator(self.csp, var)
+        if status and self.best_cost is not None:
+            status = self.enforce_bound()
+        self.nPrunings = self.nPrunings + self.trail.nPrunings - count
+        return status, prunings
+
+    def enforce_bound(self):
+        '''Branch and bound: return False if the objective cannot get
+           below the cost of the best solution found, else prune the
+           values that cannot and return True if no domain was wiped out.
+           The prunings are logged in the trail.'''
+        if self.objective.lower_bound(self.csp) >= self.best_cost:
+            return False
+        for var, val in self.objective.prune(self.csp, self.best_cost):
+            if var.in_cur_domain(val) and not var.is_assigned():
+                var.prune_value(val)
+                if var.cur_domain_size() == 0:
+                    return False
+        return True
+
+    def record_solution(self):
+        '''Branch and bound: save the current complete assignment as the
+           best one. Later branches must cost less.'''
+        self.best = dict((v, v.get_assigned_value()) for v in self.csp.vars)
+        self.best_cost = self.objective.value(self.csp)
+        self.nSolutions = self.nSolutions + 1
+        if self.TRACE:
+            print("new best solution, {} = {}".format(self.objective.name,
+                                                      self.best_cost))
+
     def restore_all_variable_domains(self):
         '''Reinitialize all variable domains'''
         for var in self.csp.vars:
@@ -441,29 +1766,104 @@ class BT:
             var.restore_curdom()
 
     def extractMRVvar(self):
-        '''Remove variable with minimum sized cur domain from list of
-           unassigned vars. Would be faster to use heap...but this is
-           not production code.
+        '''Remove variable with minimum sized cur domain from the queue
+           of unassigned vars. Ties are broken by the order of the
+           variables in the CSP, or by a random order if the search is
+           randomized (see set_restarts).
         '''
+        return self.unasgn_vars.pop()
+
+    def select_var(self):
+        '''Remove the next variable to assign from the queue of unassigned
+           vars, using the heuristic chosen with set_var_heuristic'''
+        if self.var_heuristic == "mrv":
+            return self.extractMRVvar()
+
+        #dom/wdeg and dom/ddeg: minimize the ratio of the current domain
+        #size to the weighted degree of the variable, counting only
+        #constraints with another unassigned variable
+        weighted = self.var_heuristic == "dom/wdeg"
+        active = dict()
+        best = None
+        for var in self.unasgn_vars.members:
+            deg = 0
+            for c in self.csp.vars_to_cons[var]:
+                if not c in active:
+                    active[c] = c.get_n_unasgn() > 1
+                if active[c]:
+                    deg = deg + (c.weight if weighted else 1)
+            score = (var.cur_domain_size() / deg if deg else float("inf"),
+                     self.unasgn_vars.rank[var])
+            if best is None or score < best[0]:
+                best = (score, var)
+        if best is None:
+            return None
+        self.unasgn_vars.remove(best[1])
+        return best[1]
+
+    def init_unasgn_vars(self):
+        '''Put all unassigned variables in a new MRV queue, in a random
+           tie breaking order if the search is randomized'''
+        self.unasgn_vars.clear()
+        order = list(self.csp.vars)
+        if self.rng:
+            self.rng.shuffle(order)
+        self.unasgn_vars = MRVQueue(order)
+        for v in order:
+            if not v.is_assigned():
+                self.unasgn_vars.push(v)
+
+    def value_order(self, var, propagator):
+        '''Return the values of var's current domain in the order they
+           are tried, using the ordering chosen with set_value_order. If
+           the search is randomized the values are shuffled first, so the
+           ordering keeps them in random order when it ties.'''
+        vals = var.cur_domain()
+        if self.rng:
+            self.rng.shuffle(vals)
+        if self.value_key is not None:
+            vals.sort(key=lambda val: self.value_key(var, val))
+        if self.value_ordering == "lcv":
+            costs = dict((val, self.lcv_cost(var, val, propagator)) for val in vals)
+            vals.sort(key=lambda val: costs[val])
+        hint = self.hints.get(var)
+        if hint is not None and hint in vals and vals[0] != hint:
+            vals.remove(hint)
+            vals.insert(0, hint)
+        return vals
 
-        md = -1
-        mv = None
-        for v in self.unasgn_vars:
-            if md < 0:
-                md = v.cur_domain_size()
-                mv = v
-            elif v.cur_domain_size() < md:
-                md = v.cur_domain_size()
-                mv = v
-        self.unasgn_vars.remove(mv)
-        return mv
+    def lcv_cost(self, var, val, propagator):
+        '''Return the number of values the propagator prunes when var is
+           assigned val, or inf if that is a dead end. The assignment and
+           the prunings are undone, and not counted in the statistics nor
+           in the constraint weights.'''
+        if not var.assign(val):
+            return float("inf")
+        checkpoint = self.trail.level()
+        count = self.trail.nPrunings
+        self.csp.probing = True
+        status, prunings = propagator(self.csp, var)
+        self.csp.probing = False
+        cost = self.trail.nPrunings - count if status else float("inf")
+        self.trail.undo(checkpoint)
+        var.unassign()
+        return cost
 
     def restoreUnasgnVar(self, var):
-        '''Add variable back to list of unassigned vars'''
-        self.unasgn_vars.append(var)
+        '''Add variable back to queue of unassigned vars'''
+        self.unasgn_vars.push(var)
         
-    def bt_search(self,propagator):
-        '''Try to solve the CSP using specified propagator routine
+    def solve(self, propagator):
+        '''Same as bt_search without printing anything. Returns a
+           SearchResult.'''
+        return self.bt_search(propagator, verbose=False)
+
+    def bt_search(self, propagator, verbose=True):
+        '''Try to solve the CSP using specified propagator routine.
+           Returns a SearchResult. When a solution is found the variables
+           are also left assigned to it.
+
+           verbose == print the outcome, the solution and the statistics
 
            propagator == a function with the following template
            propagator(csp, newly_instantiated_variable=None)
@@ -488,86 +1888,444 @@ class BT:
 
            The list of variable values pairs are all of the values
            the propagator pruned (using the variable's prune_value method). 
-           bt_search NEEDS to know this in order to correctly restore these 
-           values when it undoes a variable assignment.
+           bt_search logs every pruning in a Trail while it runs and
+           undoes them by rewinding the trail, so propagators may return an
+           empty list when csp.trail is set.
 
            NOTE propagator SHOULD NOT prune a value that has already been 
            pruned! Nor should it prune a value twice'''
 
         self.clear_stats()
-        stime = time.process_time()
+        stime = self.start_cpu = time.process_time()
+        wtime = self.start_wall = time.perf_counter()
+        self.partial = dict()
+        self.open_nodes = []
+        self.best = None
+        self.best_cost = self.bound if self.objective is not None else None
 
         self.restore_all_variable_domains()
+        self.attach_trail()
+        fixed = self.assign_fixed()
         
-        self.unasgn_vars = []
-        for v in self.csp.vars:
-            if not v.is_assigned():
-                self.unasgn_vars.append(v)
+        self.rng = random.Random(self.seed) if self.seed is not None else None
+        for c in self.csp.get_all_cons():
+            c.weight = 1
+        self.init_unasgn_vars()
 
-        status, prunings = propagator(self.csp) #initial propagate no assigned variables.
-        self.nPrunings = self.nPrunings + len(prunings)
+        if fixed:
+            status, prunings = self.propagate(propagator) #initial propagate no assigned variables.
+        else:
+            status, prunings = False, []
 
         if self.TRACE:
             print(len(self.unasgn_vars), " unassigned variables at start of search")
             print("Root Prunings: ", prunings)
 
         if status == False:
-            print("CSP{} detected contradiction at root".format(
-                self.csp.name))
+            if verbose:
+                print("CSP{} detected contradiction at root".format(
+                    self.csp.name))
+        else:
+            #now do the search, restarting from the root propagation
+            #each time a cutoff is reached
+            root = self.trail.level()
+            for cutoff in self.restart_cutoffs():
+                status = self.bt_iterate(propagator, cutoff)
+                if status is not None or self.limit_reached():
+                    break
+                self.nRestarts = self.nRestarts + 1
+                if self.TRACE:
+                    print("restart", self.nRestarts, "after", cutoff, "failures")
+                self.trail.undo(root)
+                self.init_unasgn_vars()
+
+        assignment = dict()
+        optimal = False
+        if self.best is not None:
+            #branch and bound, the search ends when it proved optimality
+            assignment = self.best
+            result_status = SearchResult.SOLVED
+            optimal = status == False
+            status = True
+        elif status == True:
+            for v in self.csp.vars:
+                assignment[v] = v.get_assigned_value()
+            result_status = SearchResult.SOLVED
+        elif status is None:
+            assignment = self.partial
+            result_status = SearchResult.UNKNOWN
         else:
-            status = self.bt_recurse(propagator, 1)   #now do recursive search
+            result_status = SearchResult.UNSAT
+
+        self.trail.undo(0)
+        self.detach_trail()
+        self.unasgn_vars.clear()
+        if self.best is not None:
+            #leave the variables assigned to the best solution
+            for v, val in self.best.items():
+                if v.is_assigned():
+                    v.unassign()
+            for v, val in self.best.items():
+                v.assign(val)
+        self.runtime = time.process_time() - stime
+        result = SearchResult(result_status, assignment, self.runtime, 
+                              time.perf_counter() - wtime,
+                              self.nDecisions, self.nPrunings,
+                              self.best_cost, optimal)
+
+        if verbose:
+            if status is None:
+                print("CSP {} unknown. Search limit reached, {} variables assigned at best".format(
+                    self.csp.name, len(assignment)))
+            if status == False:
+                print("CSP{} unsolved. Has no solutions".format(self.csp.name))
+            if status == True:
+                print("CSP {} solved. CPU Time used = {}".format(self.csp.name,
+                                                                 self.runtime))
+                if self.best is not None:
+                    print("{} = {}{}".format(self.objective.name, self.best_cost,
+                                             " (optimal)" if optimal else ""))
+                self.csp.print_soln()
+
+            print("bt_search finished")
+            self.print_stats()
+        return result
+
+    def bt_iterate(self, propagator, cutoff=None):
+        '''Depth first search driven by an explicit stack instead of
+           recursion, so the number of variables is not bounded by
+           Python's recursion limit. Return true if found solution, false
+           if there is no solution, None if a search limit was reached
+           (see set_limits) or after cutoff failed assignments (if cutoff
+           is not None). In that case the variables are unassigned and the
+           deepest partial assignment reached is in self.partial. Only
+           when a search limit stopped it, the subtrees left unexplored
+           are in self.open_nodes (see unexplored), otherwise
+           self.open_nodes is empty.
+
+           Each stack frame is [var, values to try, index of the next
+           value, trail checkpoint of the current value].'''
+        stack = []
+        self.open_nodes = []
+        descend = True
+        deepest = len(self.partial) #depth of the deepest partial assignment reached
+        saved = True                #whether it is saved in self.partial
+        failures = 0
+        while True:
+            if descend:
+                if self.unasgn_vars:
+                    var = self.select_var()
+                    if self.TRACE:
+                        print('  ' * (len(stack)+1), "bt_iterate var = ", var)
+                    stack.append([var, self.value_order(var, propagator), 0, 0])
+                elif self.objective is None:
+                    #all variables assigned
+                    return True
+                else:
+                    #branch and bound, keep searching for a better solution
+                    self.record_solution()
+                    if not stack:
+                        return False
+
+            frame = stack[-1]
+            var, vals = frame[0], frame[1]
+            level = len(stack)
+            if var.is_assigned():
+                #back from a failed subtree, undo the current value
+                if not saved:
+                    self.save_partial(stack)
+                    saved = True
+                if self.TRACE:
+                    print('  ' * level, "bt_iterate restoring ", var)
+                self.trail.undo(frame[3])
+                var.unassign()
 
+            descend = False
+            while frame[2] < len(vals):
+                if self.limit_reached() or (cutoff is not None and failures >= cutoff):
+                    if not saved:
+                        self.save_partial(stack)
+                    if self.limit_reached():
+                        self.open_nodes = self.unexplored(stack)
+                    for f in stack:
+                        if f[0].is_assigned():
+                            f[0].unassign()
+                    return None
+
+                val = vals[frame[2]]
+                frame[2] += 1
 
-        self.restoreValues(prunings)
-        if status == False:
-            print("CSP{} unsolved. Has no solutions".format(self.csp.name))
-        if status == True:
-            print("CSP {} solved. CPU Time used = {}".format(self.csp.name,
-                                                             time.process_time() - stime))
-            self.csp.print_soln()
+                if self.TRACE:
+                    print('  ' * level, "bt_iterate trying", var, "=", val)
 
-        print("bt_search finished")
-        self.print_stats()
+                if var.assign(val):
+                    self.nDecisions = self.nDecisions+1
 
-    def bt_recurse(self, propagator, level):
-        '''Return true if found solution. False if still need to search.
-           If top level returns false--> no solution'''
+                    frame[3] = self.trail.level()
+                    status, prunings = self.propagate(propagator, var)
 
-        if self.TRACE:
-            print('  ' * level, "bt_recurse level ", level)
-           
-        if not self.unasgn_vars:
-            #all variables assigned
-            return True
-        else:
-            var = self.extractMRVvar()
-            if self.TRACE:
-                print('  ' * level, "bt_recurse var = ", var)
+                    if self.TRACE:
+                        print('  ' * level, "bt_iterate prop status = ", status)
+                        print('  ' * level, "bt_iterate prop pruned = ", prunings)
 
-            for val in var.cur_domain():
+                    if status:
+                        descend = True
+                        if level > deepest:
+                            deepest = level
+                            saved = False
+                        break
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse trying", var, "=", val)
+                    self.trail.undo(frame[3])
+                    var.unassign()
+                failures = failures + 1
+
+            if not descend:
+                #all values failed, backtrack
+                stack.pop()
+                self.restoreUnasgnVar(var)
+                if not stack:
+                    return False
+
+    def set_limits(self, time_limit=None, cpu_limit=None, max_decisions=None,
+                   max_prunings=None):
+        '''Bound the next searches. time_limit and cpu_limit are in
+           seconds of wall clock and CPU time (time.process_time),
+           max_decisions and max_prunings bound nDecisions and nPrunings.
+           None means no limit. A search stopped by a limit returns an
+           UNKNOWN SearchResult holding the deepest partial assignment
+           found.'''
+        self.time_limit = time_limit
+        self.cpu_limit = cpu_limit
+        self.max_decisions = max_decisions
+        self.max_prunings = max_prunings
+
+    def limit_reached(self):
+        '''Check the search limits'''
+        if self.max_decisions is not None and self.nDecisions >= self.max_decisions:
+            return True
+        if self.max_prunings is not None and self.nPrunings >= self.max_prunings:
+            return True
+        if self.time_limit is not None and \
+                time.perf_counter() - self.start_wall >= self.time_limit:
+            return True
+        if self.cpu_limit is not None and \
+                time.process_time() - self.start_cpu >= self.cpu_limit:
+            return True
+        return False
 
+    def set_var_heuristic(self, heuristic="mrv"):
+        '''Choose how the next searches select the variable to assign.
+
+           heuristic == "mrv"      smallest current domain (the default)
+                        "dom/wdeg" smallest ratio of current domain size to
+                                   the sum of the weights of the variable's
+                                   constraints that have another unassigned
+                                   variable. Weights start at 1 for each
+                                   search and are bumped by the propagators
+                                   each time a constraint causes a dead end,
+                                   so the search focuses on the variables of
+                                   the constraints that fail most.
+                        "dom/ddeg" same with every weight equal to 1 (the
+                                   dynamic degree)
+
+           Ties are broken as in extractMRVvar. dom/wdeg and dom/ddeg scan
+           all unassigned variables at each decision.'''
+        if not heuristic in ("mrv", "dom/wdeg", "dom/ddeg"):
+            print("Error: unknown variable heuristic {}".format(heuristic))
+            heuristic = "mrv"
+        self.var_heuristic = heuristic
+
+    def set_value_order(self, ordering="domain", key=None):
+        '''Choose the order in which the next searches try the values of
+           a variable.
+
+           ordering == "domain"   the order of the domain, i.e., the order
+                                  add_domain_values added them (the default)
+                       "lcv"      least constraining value first: each value
+                                  is assigned and propagated in turn, and
+                                  values are sorted by the number of values
+                                  pruned from the other variables (dead ends
+                                  last). This costs one propagation per value
+                                  at each decision.
+           key      == if not None, a function key(var, val) the values are
+                       sorted by, e.g. to try first the values that suit the
+                       problem best. With "lcv" it breaks the ties.'''
+        if not ordering in ("domain", "lcv"):
+            print("Error: unknown value ordering {}".format(ordering))
+            ordering = "domain"
+        self.value_ordering = ordering
+        self.value_key = key
+
+    def set_objective(self, objective=None, bound=None):
+        '''Make the next searches minimize objective (an Objective) by
+           branch and bound, or just find a solution if objective is None.
+           If bound is not None only solutions costing less than bound are
+           searched for, so if there are none the search returns UNSAT.
+
+           Each time a solution is found it is saved and the search goes
+           on, only accepting assignments that cost less: after each
+           propagation the search backtracks if objective.lower_bound
+           reaches the best cost, and prunes the values returned by
+           objective.prune. bt_search returns the best solution found, with
+           optimal set if the search completed. If a search limit stops it
+           (see set_limits) the best solution so far is returned.'''
+        self.objective = objective
+        self.bound = bound
+
+    def set_fixed(self, assignment=None):
+        '''Keep the variables of assignment (a dict mapping variables to
+           values) assigned during the next searches, so only the other
+           variables are searched. They are assigned before the initial
+           propagation, and stay assigned after the search like the
+           variables of a solution. If they cannot all be assigned the
+           search returns UNSAT.'''
+        self.fixed = dict(assignment) if assignment else dict()
+
+    def set_hints(self, assignment=None):
+        '''Try the values of assignment (a dict mapping variables to
+           values, e.g., a previous solution) first in the next searches,
+           before the values ordered as chosen with set_value_order. This
+           warm starts the search: if the hints are consistent it finds
+           them without backtracking.'''
+        self.hints = dict(assignment) if assignment else dict()
+
+    def assign_fixed(self):
+        '''Assign the fixed variables (see set_fixed). Return False,
+           leaving them unassigned, if one of them cannot be assigned or
+           if they violate a constraint among them: propagators only
+           check constraints with unassigned variables at the root.'''
+        done = []
+        for var, val in self.fixed.items():
+            if not var.assign(val):
+                break
+            done.append(var)
+        else:
+            cons = set(c for var in done for c in self.csp.get_cons_with_var(var))
+            if all(c.get_n_unasgn() != 0 or 
+                   c.check([v.get_assigned_value() for v in c.get_scope()])
+                   for c in cons):
+                return True
+        for v in done:
+            v.unassign()
+        return False
+
+    def set_restarts(self, policy=None, base=100, factor=1.5, seed=None):
+        '''Configure restarts and randomization of the next searches.
+
+           policy == None (never restart), "luby" or "geometric". The
+                     search restarts from the root after a number of failed
+                     assignments: base times the Luby sequence
+                     (1, 1, 2, 1, 1, 2, 4, ...) or base * factor**i for
+                     the i-th restart.
+           seed   == if not None, ties in variable selection and the order
+                     of values are randomized with a random.Random(seed),
+                     so the search is reproducible for a given seed.
+
+           Restarts are only useful with a seed, otherwise every run
+           repeats the same search.'''
+        if not policy in (None, "luby", "geometric"):
+            print("Error: unknown restart policy {}".format(policy))
+            policy = None
+        self.restart_policy = policy
+        self.restart_base = base
+        self.restart_factor = factor
+        self.seed = seed
+        self.rng = None
+
+    def restart_cutoffs(self):
+        '''Generate the failure cutoff of each run, None for no cutoff'''
+        if self.restart_policy is None:
+            yield None
+        elif self.restart_policy == "luby":
+            i = 1
+            while True:
+                yield self.restart_base * luby(i)
+                i = i + 1
+        else:
+            cutoff = float(self.restart_base)
+            while True:
+                yield int(cutoff)
+                cutoff = cutoff * self.restart_factor
+
+    def unexplored(self, stack):
+        '''Return the subtrees of the search stack not explored yet, each
+           given by the list of (var, val) decisions leading to it: for
+           each frame, the values not tried yet, after the values assigned
+           by the frames below it.'''
+        nodes = []
+        prefix = []
+        for f in stack:
+            var, vals = f[0], f[1]
+            for val in vals[f[2]:]:
+                nodes.append(prefix + [(var, val)])
+            if var.is_assigned():
+                prefix = prefix + [(var, var.get_assigned_value())]
+        return nodes
+
+    def split(self, propagator, n):
+        '''Split the search space in (if possible) at least n subproblems,
+           for parallel search. Each subproblem (a cube) is the list of
+           (var, val) decisions leading to it, and the cubes hold all the
+           solutions (of the fixed variables, see set_fixed). Cubes are
+           expanded breadth first: after assigning the decisions of a cube
+           and propagating, its next variable is chosen and ordered as in
+           the search, and the values failing propagation are dropped.
+           Cubes with every variable assigned are not expanded. If all the
+           cubes fail the list is empty. The decisions and prunings made
+           are counted in the statistics.'''
+        self.clear_stats()
+        self.rng = None
+        cubes = [[]]
+        while len(cubes) < n:
+            expanded = []
+            grew = False
+            for cube in cubes:
+                children = self.expand(propagator, cube)
+                if children is None:
+                    expanded.append(cube)
+                else:
+                    expanded.extend(children)
+                    grew = True
+            cubes = expanded
+            if not grew:
+                break
+        return cubes
+
+    def expand(self, propagator, cube):
+        '''Return the cubes extending cube with one more decision (see
+           split), or None if cube assigns every variable'''
+        children = []
+        self.restore_all_variable_domains()
+        self.attach_trail()
+        status = self.assign_fixed()
+        for var, val in cube:
+            status = status and var.assign(val)
+        if status:
+            self.init_unasgn_vars()
+            status, prunings = self.propagate(propagator)
+        if status and not self.unasgn_vars:
+            children = None
+        elif status:
+            var = self.select_var()
+            for val in self.value_order(var, propagator):
                 if var.assign(val):
                     self.nDecisions = self.nDecisions+1
-    
-                    status, prunings = propagator(self.csp, var)
-                    self.nPrunings = self.nPrunings + len(prunings)
-    
-                    if self.TRACE:
-                        print('  ' * level, "bt_recurse prop status = ", status)
-                        print('  ' * level, "bt_recurse prop pruned = ", prunings)
-    
+                    checkpoint = self.trail.level()
+                    status, prunings = self.propagate(propagator, var)
                     if status:
-                        if self.bt_recurse(propagator, level+1):
-                            return True
-    
-                    if self.TRACE:
-                        print('  ' * level, "bt_recurse restoring ", prunings)
-                    self.restoreValues(prunings)
+                        children.append(cube + [(var, val)])
+                    self.trail.undo(checkpoint)
                     var.unassign()
-
-            self.restoreUnasgnVar(var)
-            return False
+        self.trail.undo(0)
+        self.detach_trail()
+        self.unasgn_vars.clear()
+        self.restore_all_variable_domains()
+        return children
+
+    def save_partial(self, stack):
+        '''Save the assignments of the search stack in self.partial'''
+        self.partial = dict()
+        for f in stack:
+            if f[0].is_assigned():
+                self.partial[f[0]] = f[0].get_assigned_value()
 
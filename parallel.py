@@ -0,0 +1,270 @@
+'''
+Parallel search over scheduler models, using multiprocessing.
+
+CSP models cannot be sent to other processes: Variables hold Task and Slot
+object graphs, and constraints hold functions and search caches. Instead
+workers receive a ModelSpec, the inputs of scheduler_csp_model, and rebuild
+the model from it. Since scheduler_csp_model is deterministic the rebuilt
+Variables have the same names and domains, so solutions are sent back as
+the position of each value in the domain of the Variable with the same name,
+and mapped back to the Variables of the caller's model.
+
+portfolio_solve runs different search configurations on the whole model.
+parallel_solve splits the search space of one configuration into subtrees
+(see BT.split) searched by a pool of workers. Each worker searches its
+subtree for a fixed number of decisions (the node limit) and then sends back
+the subtrees it did not explore, which are queued again for the next free
+worker. Work is only redistributed at these node limit boundaries: there is
+no work stealing, a busy worker is never interrupted to share its subtree.
+
+A search configuration is a dict with the optional keys:
+    "propagator":    the propagator function (default prop_FC)
+    "var_heuristic": see BT.set_var_heuristic
+    "value_order":   see BT.set_value_order
+    "value_key":     sort key of the values, e.g. pack_key (see
+                     BT.set_value_order)
+    "restarts":      restart policy, see BT.set_restarts
+    "seed":          seed of the randomized search, see BT.set_restarts
+    "objective":     name of an objective to minimize, see
+                     scheduler_objective
+'''
+
+import multiprocessing
+import queue
+import time
+from collections import deque
+from scheduler_csp import *
+
+
+DEFAULT_CONFIGS = [
+    {"propagator": prop_FC},
+    {"propagator": prop_GAC},
+    {"propagator": prop_FC, "var_heuristic": "dom/wdeg", "restarts": "luby",
+        "seed": 1},
+    {"propagator": prop_GAC, "var_heuristic": "dom/wdeg",
+        "value_key": pack_key, "restarts": "luby", "seed": 2},
+]
+
+
+class ModelSpec:
+    '''
+    The inputs of scheduler_csp_model, which can be pickled and sent to
+    other processes to rebuild the model there.
+    '''
+    def __init__(self, tasks_list, start_date, initial_schedule, start_hrs=[],
+        alldiff_mode="gac", extensional=False):
+        self.tasks_list = list(tasks_list)
+        self.start_date = start_date
+        self.initial_schedule = initial_schedule
+        self.start_hrs = list(start_hrs)
+        self.alldiff_mode = alldiff_mode
+        self.extensional = extensional
+
+    def build(self):
+        '''Return scheduler_csp, variable_array (see scheduler_csp_model).'''
+        return scheduler_csp_model(self.tasks_list, self.start_date,
+            self.initial_schedule, self.start_hrs, self.alldiff_mode,
+            self.extensional)
+
+
+def configure(bt, config, var_array):
+    '''
+    Set up the BT object bt for a search configuration (see the module
+    description).
+    '''
+    bt.set_var_heuristic(config.get("var_heuristic", "mrv"))
+    bt.set_value_order(config.get("value_order", "domain"),
+        config.get("value_key"))
+    bt.set_restarts(config.get("restarts"), seed=config.get("seed"))
+    if config.get("objective"):
+        bt.set_objective(scheduler_objective(config["objective"], var_array))
+    else:
+        bt.set_objective(None)
+
+
+def encode_result(result):
+    '''
+    Return a picklable form of a SearchResult: its assignment maps Variable
+    names to the position of their value in their domain.
+    '''
+    assignment = dict((v.name, v.value_index(val))
+        for v, val in result.assignment.items())
+    return (result.status, assignment, result.cpu_time, result.wall_time,
+        result.nDecisions, result.nPrunings, result.cost, result.optimal)
+
+
+def decode_result(data, var_array):
+    '''
+    Return the SearchResult encoded by encode_result, with the assignment
+    mapped to the Variables of var_array.
+    '''
+    status, names, cpu_time, wall_time, nDecisions, nPrunings, cost, \
+        optimal = data
+    by_name = dict((v.name, v) for v in var_array)
+    assignment = dict((by_name[name], by_name[name].dom[i])
+        for name, i in names.items())
+    return SearchResult(status, assignment, cpu_time, wall_time, nDecisions,
+        nPrunings, cost, optimal)
+
+
+def portfolio_worker(job):
+    '''Rebuild the model and run one configuration on it.'''
+    i, spec, config, time_limit = job
+    csp, var_array = spec.build()
+    bt = BT(csp)
+    configure(bt, config, var_array)
+    bt.set_limits(time_limit=time_limit)
+    result = bt.solve(config.get("propagator", prop_FC))
+    return i, encode_result(result)
+
+
+def portfolio_solve(spec, configs=DEFAULT_CONFIGS, processes=None,
+    time_limit=None):
+    '''
+    Run the search configurations configs in parallel on the model of the
+    ModelSpec spec, one process each (at most processes at a time). The
+    first search that solves the model or proves it unsatisfiable wins, and
+    the other processes are terminated. time_limit bounds each search, in
+    seconds.
+
+    Return scheduler_csp, variable_array, result, config: the model built
+    in this process, with its Variables assigned to the solution found, the
+    SearchResult of the winning search, and its configuration. If every
+    search reached its time limit, the result of the first one to stop is
+    returned.
+    '''
+    csp, var_array = spec.build()
+    jobs = [(i, spec, config, time_limit) for i, config in enumerate(configs)]
+    best = None
+    with multiprocessing.Pool(processes or len(jobs)) as pool:
+        for i, data in pool.imap_unordered(portfolio_worker, jobs):
+            if best is None or data[0] != SearchResult.UNKNOWN:
+                best = (i, data)
+            if data[0] != SearchResult.UNKNOWN:
+                break
+
+    i, data = best
+    result = decode_result(data, var_array)
+    if result.is_solved():
+        for v, val in result.assignment.items():
+            v.assign(val)
+    return csp, var_array, result, configs[i]
+
+
+def encode_cube(cube):
+    '''
+    Return a picklable form of a cube (a list of (Variable, value) decisions,
+    see BT.split): the list of the Variable names and value positions.
+    '''
+    return [(v.name, v.value_index(val)) for v, val in cube]
+
+
+def decode_cube(cube, by_name):
+    '''
+    Return the decisions of an encoded cube on the Variables of by_name (a
+    dict mapping names to Variables).
+    '''
+    return [(by_name[name], by_name[name].dom[i]) for name, i in cube]
+
+
+def tree_worker(job):
+    '''
+    Rebuild the model and search the subtree of a cube, with a node limit
+    and, when minimizing, the best cost known as bound. Return the encoded
+    result and the encoded cubes of the subtrees left unexplored.
+    '''
+    spec, config, cube, node_limit, bound = job
+    csp, var_array = spec.build()
+    by_name = dict((v.name, v) for v in var_array)
+    bt = BT(csp)
+    configure(bt, config, var_array)
+    if bt.objective is not None:
+        bt.set_objective(bt.objective, bound)
+    bt.set_fixed(dict(decode_cube(cube, by_name)))
+    bt.set_limits(max_decisions=node_limit)
+    result = bt.solve(config.get("propagator", prop_FC))
+    open_nodes = [cube + encode_cube(node) for node in bt.open_nodes]
+    return encode_result(result), open_nodes
+
+
+def parallel_solve(spec, config={}, processes=None, node_limit=1000, split=4,
+    time_limit=None):
+    '''
+    Search the model of the ModelSpec spec with the search configuration
+    config, splitting it in subtrees searched in parallel by processes
+    workers (by default one per CPU).
+
+    The search space is first split into about split*processes cubes (see
+    BT.split). Each worker searches one cube for at most node_limit
+    decisions and returns the subtrees it left unexplored, which are queued
+    again. Without an objective the search stops at the first solution.
+    With one (see configure), the best cost found so far bounds the search
+    of the next cubes, and the search ends when all cubes are explored.
+    time_limit bounds the whole search, in seconds.
+
+    Return scheduler_csp, variable_array, result: the model built in this
+    process, with its Variables assigned to the solution found, and a
+    SearchResult. Its statistics add up those of all the workers and of the
+    split, and its cpu_time is the CPU time of all the processes.
+    '''
+    stime, wtime = time.process_time(), time.perf_counter()
+    csp, var_array = spec.build()
+    by_name = dict((v.name, v) for v in var_array)
+    bt = BT(csp)
+    configure(bt, config, var_array)
+    processes = processes or multiprocessing.cpu_count()
+    cubes = deque(encode_cube(c) for c in
+        bt.split(config.get("propagator", prop_FC), split*processes))
+    nDecisions, nPrunings, cpu_time = bt.nDecisions, bt.nPrunings, 0
+
+    minimize = bool(config.get("objective"))
+    best = None       #(cost, encoded assignment) of the best solution
+    running = 0
+    timed_out = False
+    done = queue.Queue()
+    with multiprocessing.Pool(processes) as pool:
+        while cubes or running:
+            while cubes and running < processes:
+                job = (spec, config, cubes.pop(), node_limit,
+                    best[0] if best else None)
+                pool.apply_async(tree_worker, (job,), callback=done.put,
+                    error_callback=done.put)
+                running += 1
+            wait = None
+            if time_limit is not None:
+                wait = time_limit-(time.perf_counter()-wtime)
+            try:
+                if wait is not None and wait <= 0:
+                    raise queue.Empty
+                item = done.get(timeout=wait)
+            except queue.Empty:
+                timed_out = True
+                break
+            if isinstance(item, BaseException):
+                raise item
+            running -= 1
+            data, open_nodes = item
+            status, assignment, cpu, wall, dec, pru, cost, optimal = data
+            nDecisions += dec
+            nPrunings += pru
+            cpu_time += cpu
+            cubes.extend(open_nodes)
+            if status == SearchResult.SOLVED:
+                if best is None or (minimize and cost < best[0]):
+                    best = (cost, assignment)
+                if not minimize:
+                    break
+
+    exhausted = not timed_out and not cubes and not running
+    cpu_time += time.process_time()-stime
+    wall_time = time.perf_counter()-wtime
+    if best is not None:
+        assignment = dict(decode_cube(best[1].items(), by_name))
+        for v, val in assignment.items():
+            v.assign(val)
+        return csp, var_array, SearchResult(SearchResult.SOLVED, assignment,
+            cpu_time, wall_time, nDecisions, nPrunings, best[0],
+            minimize and exhausted)
+    status = SearchResult.UNSAT if exhausted else SearchResult.UNKNOWN
+    return csp, var_array, SearchResult(status, dict(), cpu_time, wall_time,
+        nDecisions, nPrunings)
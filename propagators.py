@@ -30,8 +30,11 @@ propagator == a function with the following template
 
     The list of variable valus pairs are all of the values
     the propagator pruned (using the variable's prune_value method).
-    bt_search NEEDS to know this in order to correctly restore these
-    values when it undoes a variable assignment.
+    While bt_search runs it sets csp.trail, which records every pruning and
+    is used to restore them when it undoes a variable assignment. The
+    propagators below then return an empty list instead of collecting
+    their prunings (see prune_list). Propagators that always return their
+    prunings still work.
 
     NOTE propagator SHOULD NOT prune a value that has already been
     pruned! Nor should it prune a value twice
@@ -59,8 +62,39 @@ propagator == a function with the following template
 
             for gac we initialize the GAC queue with all constraints containing
             V.
+
+    What a constraint prunes is decided by its forward_check (FC) and
+    get_unsupported (GAC) methods, so global constraints such as
+    AllDiffConstraint can filter with their own algorithms.
+
+    When a constraint causes a deadend (a failed check or a domain wipe
+    out) the propagators bump its weight (see conflict), which the dom/wdeg
+    variable heuristic of BT uses.
 '''
 
+from collections import deque
+
+def prune_list(csp):
+    '''Return the list propagators collect their prunings in. When bt_search
+    records prunings in csp.trail there is no need to collect them, and None
+    is returned instead.'''
+    if csp.trail is None:
+        return []
+    return None
+
+def prune(var, val, pruned):
+    '''Prune val from the current domain of var and add the pair to pruned,
+    unless pruned is None.'''
+    var.prune_value(val)
+    if pruned is not None:
+        pruned.append((var, val))
+
+def conflict(csp, c):
+    '''Record that constraint c caused a deadend, unless BT is only trying
+    a value out (see csp.probing).'''
+    if not csp.probing:
+        c.weight = c.weight + 1
+
 def prop_BT(csp, newVar=None):
     '''Do plain backtracking propagation. That is, do no
     propagation at all. Just check fully instantiated constraints'''
@@ -74,6 +108,7 @@ def prop_BT(csp, newVar=None):
             for var in vars:
                 vals.append(var.get_assigned_value())
             if not c.check(vals):
+                conflict(csp, c)
                 return False, []
     return True, []
 
@@ -106,22 +141,19 @@ def prop_FC(csp, newVar=None):
         list is a set of variable/value pairs that are all of the values the
         propagator pruned.
     '''
-    pruned = []
+    pruned = prune_list(csp)
     if not newVar:
         cons = csp.get_all_cons()
     else:
         cons = csp.get_cons_with_var(newVar)
     
     for c in cons:
-        if c.get_n_unasgn() == 1:
-            var = c.get_unasgn_vars()[0]
-            for x in var.cur_domain():
-                if not c.has_support(var, x):
-                    pruned.append((var, x))
-                    var.prune_value(x)
+        for var, x in c.forward_check(newVar):
+            prune(var, x, pruned)
             if var.cur_domain_size() == 0:
-                return False, pruned
-    return True, pruned
+                conflict(csp, c)
+                return False, pruned or []
+    return True, pruned or []
 #IMPLEMENT
 
 def prop_GAC(csp, newVar=None):
@@ -129,6 +161,14 @@ def prop_GAC(csp, newVar=None):
     for complete description of what propagator functions should take as input
     and return.
 
+    The GAC queue holds arcs (constraint, variable): revising an arc removes
+    the values of the variable without support in the constraint. When a
+    variable loses values only the arcs of the other variables of its
+    constraints are queued again. Constraints with whole_scope set are
+    queued as a single arc (constraint, None) and filter their whole scope.
+    The queue is a deque with a set of the queued arcs, so queueing and
+    removing arcs are O(1).
+
     Input: csp, (optional) newVar.
         csp is a CSP object---the propagator uses this to access the variables
         and constraints.
@@ -147,27 +187,127 @@ def prop_GAC(csp, newVar=None):
     list is a set of variable/value pairs that are all of the values the
     propagator pruned.
     '''
-    pruned = []
+    return gac_enforce(csp, newVar)
+
+def prop_CT(csp, newVar=None):
+    '''Do GAC propagation, filtering table constraints (constraints with
+    extensional set, i.e., specified by satisfying tuples) with the
+    Compact-Table algorithm. Other constraints are filtered as in prop_GAC.
+    See beginning of this file for complete description of what propagator
+    functions should take as input and return.
+
+    Each table constraint keeps a bitset (a Python int) of its rows that are
+    still valid, i.e., whose values are all in the current domains. When the
+    domain of a variable changed, the bitset is ANDed with the union of the
+    support masks of its remaining values (see Constraint.support_masks),
+    and every value whose mask no longer intersects the bitset is pruned.
+    During bt_search the bitset is saved on csp.trail, so it is restored on
+    backtracking. Outside of search it is rebuilt on every call.
+
+    The masks take (number of values) x (number of rows) bits per
+    constraint.
+
+    Input and returns are the same as for prop_GAC.
+    '''
+    return gac_enforce(csp, newVar, True)
+
+def gac_enforce(csp, newVar=None, ct=False):
+    '''GAC queue of prop_GAC and prop_CT. If ct is True table constraints
+    are revised with ct_filter as a whole.'''
+    pruned = prune_list(csp)
+    queue = deque()
+    queued = set()
+
+    def enqueue(c, changed):
+        '''queue the arcs of c affected by a change of variable changed'''
+        if c.whole_scope or (ct and c.extensional):
+            arcs = [(c, None)]
+        else:
+            arcs = [(c, v) for v in c.get_scope() if v is not changed]
+        for arc in arcs:
+            if not arc in queued:
+                queued.add(arc)
+                queue.append(arc)
+
     if not newVar:
-        cons = csp.get_all_cons()
+        for c in csp.get_all_cons():
+            enqueue(c, None)
     else:
-        cons = csp.get_cons_with_var(newVar)
+        for c in csp.get_cons_with_var(newVar):
+            enqueue(c, newVar)
+
+    while queue:
+        arc = queue.popleft()
+        queued.remove(arc)
+        curr, var = arc
+        if ct and curr.extensional:
+            unsupported = ct_filter(csp, curr)
+        elif var is None:
+            unsupported = curr.get_unsupported()
+        else:
+            unsupported = curr.get_unsupported([var])
+
+        changed = []
+        for v, val in unsupported:
+            if not v.in_cur_domain(val):
+                continue
+            if v.is_assigned():
+                #the assigned value lost its support
+                conflict(csp, curr)
+                return False, pruned or []
+            prune(v, val, pruned)
+            if v.cur_domain_size() == 0:
+                conflict(csp, curr)
+                return False, pruned or []
+            if not v in changed:
+                changed.append(v)
+
+        for v in changed:
+            for c in csp.get_cons_with_var(v):
+                enqueue(c, v)
+
+    return True, pruned or []
+
+def ct_filter(csp, c):
+    '''Compact-Table filtering of the table constraint c. Returns the
+    (var, val) pairs that lost all their supports. If no row is left, the
+    values of the first variable of the scope are returned so that
+    gac_enforce fails.'''
+    masks = c.support_masks()
+    scope = c.get_scope()
+    state = c.ct_state if csp.trail is not None else None
+    if state is None:
+        valid, sizes = (1 << c.nrows) - 1, [-1] * len(scope)
+    else:
+        valid, sizes = state[0], list(state[1])
+
+    cur = []
+    for pos, var in enumerate(scope):
+        idxs = [var.value_index(val) for val in var.cur_domain()]
+        cur.append(idxs)
+        if len(idxs) != sizes[pos]:
+            mask = 0
+            for idx in idxs:
+                mask |= masks.get((pos, idx), 0)
+            valid &= mask
+            sizes[pos] = len(idxs)
+
+    if not valid:
+        var = scope[0]
+        return [(var, val) for val in var.cur_domain()]
+
+    unsupported = []
+    for pos, var in enumerate(scope):
+        if var.is_assigned():
+            continue
+        for idx in cur[pos]:
+            if not valid & masks.get((pos, idx), 0):
+                unsupported.append((var, var.dom[idx]))
+                sizes[pos] -= 1
 
-    while cons:
-        curr = cons.pop(0)
-        for var in curr.get_scope():
-            for val in var.cur_domain():
-                if not curr.has_support(var, val):
-                    pruned.append((var, val))
-                    var.prune_value(val)
-                    if var.cur_domain_size() == 0:
-                        return False, pruned
-                    else:
-                        var_cons = csp.get_cons_with_var(var)
-                        for v in var_cons:
-                             if v not in cons:
-                                cons.append(v)
-
-    return True, pruned
+    if csp.trail is not None and (valid, sizes) != state:
+        csp.trail.push(c, state)
+        c.ct_state = (valid, sizes)
+    return unsupported
 
 #IMPLEMENT
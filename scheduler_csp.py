@@ -5,6 +5,8 @@ Construct and return Scheduler CSP models.
 from cspbase import *
 from propagators import *
 import itertools
+import random
+import time
 from datetime import datetime, timedelta
 from copy import copy, deepcopy
 
@@ -15,7 +17,8 @@ days31, days30 = [1,3,5,7,8,10,12], [4,6,9,11]
 months = ["JAN","FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", 
 "OCT", "NOV", "DEC"]
 
-def scheduler_csp_model(tasks_list, start_date, initial_schedule, start_hrs=[]):
+def scheduler_csp_model(tasks_list, start_date, initial_schedule, start_hrs=[],
+    alldiff_mode="gac", extensional=False):
     '''
     OUTPUTS
     Return a CSP object representing a Scheduler CSP problem along with an 
@@ -81,6 +84,13 @@ def scheduler_csp_model(tasks_list, start_date, initial_schedule, start_hrs=[]):
     start_hrs: Optional. a list of integer od length m specifying the starting 
     hours of every day in the initial schedule. Tasks are scheduled starting 
     from these hours.
+    
+    alldiff_mode: Optional. "gac" (default) or "bounds", the filtering used by 
+    the subtasks in different Slots constraints. 
+    
+    extensional: Optional. If True the subtasks in different Slots and 
+    prerequisite constraints are built as tables of satisfying tuples instead.
+    Only the satisfying tuples are generated (see domains_permutation).
 
 
     CONSTRAINTS
@@ -102,10 +112,17 @@ def scheduler_csp_model(tasks_list, start_date, initial_schedule, start_hrs=[]):
         Due:  Tasks must be completed before due. This constraint has been 
         fused into the task Variables. When initializing Variables their 
         domains are limited to contain only Slots before due.
+        
+        Multitasking:  A Slot can hold no more tasks than the smallest multi 
+        among them. (Scope: all task Variables. CumulativeConstraint, so 
+        propagators prune values whose Slots are already full.)
     
-    The mutitasking constraint is integrated into cspbase under Variable and 
-    does checking when assigning Variables. This constraint performs real 
-    time checking. That is, without storing tuples.
+    The mutitasking constraint is also integrated into cspbase under Variable 
+    and does checking when assigning Variables. 
+    
+    The prerequisite constraints are PrecedenceConstraints and the subtasks in 
+    different Slots constraints are AllDiffConstraints, so building them does 
+    not enumerate the domains of their scopes.
     '''
     # Sort search list based on priority and due datetime
     tasks = list(tasks_list)
@@ -117,65 +134,57 @@ def scheduler_csp_model(tasks_list, start_date, initial_schedule, start_hrs=[]):
     # Split tasks into subtasks
     splitted = []
     var_array = []
+    task_vars = dict()
     for t in tasks:
-        ts = t.split()
-        sub_t_vars = []
-        
         # Initialize sub tasks as Variables
-        for sub_t in ts:
-            var = Variable(sub_t)
-            
-            if sub_t.pre and find_slot(str(sub_t.pre), slots):
-                var.add_domain_values([find_slot(str(sub_t.pre), slots)], 
-                    sub_t.span, slots)
-            else:
-                for s in slots:
-                    if s.time < sub_t.due:
-                        var.add_domain_values([s], sub_t.span, slots)
-                    else:
-                        break
-                        
-            sub_t_vars.append(var)
+        sub_t_vars = task_variables(t, slots)
             
         var_array += sub_t_vars
         splitted.append(sub_t_vars)
+        task_vars[t.name] = sub_t_vars
                 
     # Initialize CSP object
     scheduler_csp = CSP("ScheduleCSP", var_array)
     
     # No subtasks in same time slot constraints.
     for ts in splitted:
-        c = Constraint("no_duplicate_"+ts[0].name[:ts[0].name.rfind("_")], ts)
-        
-        for d in domains_permutation(ts):
-            dup = False
-            for x in d:
-                if x in d[:d.index(x)] or x in d[d.index(x)+1:]:
-                    dup = True
-                    break
-            if not dup:
-                c.add_satisfying_tuples([d])
-                
+        if len(ts) == 1:
+            continue
+        name = "no_duplicate_"+ts[0].name[:ts[0].name.rfind("_")]
+        if extensional:
+            c = Constraint(name, ts)
+            c.add_satisfying_tuples(domains_permutation(ts, no_duplicate_prefix))
+        else:
+            c = AllDiffConstraint(name, ts, alldiff_mode, slot_start)
         scheduler_csp.add_constraint(c)
         
     # Ordering constraints.
     for var in var_array:
         t=var.task
         for t0 in t.order:
-            t0_vars = find_task_vars(t0.name, var_array)
-            c = Constraint(t0.name+"_before_"+t.name, t0_vars+[var])
-            
-            for d in domains_permutation(t0_vars+[var]):
-                if check_prerequisite(d[:-1], d[-1]):
-                    c.add_satisfying_tuples([d])
-                    
+            t0_vars = task_vars.get(t0.name, [])
+            name = t0.name+"_before_"+t.name
+            if extensional:
+                c = Constraint(name, t0_vars+[var])
+                c.add_satisfying_tuples(domains_permutation(t0_vars+[var], 
+                    prerequisite_prefix(t0_vars, var)))
+            else:
+                c = PrecedenceConstraint(name, t0_vars, var, slot_start, 
+                    slot_end)
             scheduler_csp.add_constraint(c)
             
+    # Multitasking constraint.
+    if var_array:
+        scheduler_csp.add_constraint(CumulativeConstraint("multitask", 
+            var_array))
     
     return scheduler_csp, var_array
     
     
 def init_slots(start_date, initial_schedule, start_hrs=[]):
+    '''
+    Return a Calendar of the empty Slots of the initial schedule.
+    '''
     slots, t = [], copy(start_date)
     days_count = len(initial_schedule)
     if len(start_hrs) < days_count:
@@ -189,39 +198,93 @@ def init_slots(start_date, initial_schedule, start_hrs=[]):
                  (d,h)))
                 
         t += timedelta(days=1)        
-    return slots
+    return Calendar(slots)
 
 
-def domains_permutation(vars):
+def task_variables(t, slots):
     '''
-    Generates permutation of the domains of the vars list.
+    Return the Variables of the subtasks of Task t (see Task.split), whose 
+    domains hold the values starting in a Slot of the Calendar slots before 
+    the task is due, or at its pre-entered time.
     '''
-    if len(vars)==1:
-        return [(d,) for d in vars[0].domain()]
-    return [(d,)+c for c in domains_permutation(vars[1:]) for d in vars[0].domain()]
+    sub_t_vars = []
+    for sub_t in t.split():
+        var = Variable(sub_t)
+        
+        if sub_t.pre and slots.find(sub_t.pre):
+            var.add_domain_values([slots.find(sub_t.pre)], 
+                sub_t.span, slots)
+        else:
+            for s in slots:
+                if s.time < sub_t.due:
+                    var.add_domain_values([s], sub_t.span, slots)
+                else:
+                    break
+                    
+        sub_t_vars.append(var)
+    return sub_t_vars
+    
+    
+def domains_permutation(vars, accept=None):
+    '''
+    Generates permutation of the domains of the vars list, lazily. 
+    
+    accept is an optional function called on every partial tuple (values for 
+    the first variables of the list). If it returns False, no tuple starting 
+    with that partial tuple is generated. A complete tuple is generated only 
+    if it is accepted as well.
+    '''
+    doms = [v.domain() for v in vars]
+    
+    def extend(prefix):
+        if len(prefix) == len(doms):
+            yield prefix
+            return
+        for d in doms[len(prefix)]:
+            t = prefix + (d,)
+            if accept is None or accept(t):
+                for c in extend(t):
+                    yield c
+                    
+    return extend(())
+
+
+def no_duplicate_prefix(t):
+    '''
+    Accept function for domains_permutation. Reject partial tuples whose last 
+    value already appeared.
+    '''
+    return not t[-1] in t[:-1]
+    
+
+def prerequisite_prefix(prerequisite, second):
+    '''
+    Return an accept function for domains_permutation over the prerequisite 
+    Variables followed by second. Partial tuples are rejected as soon as a 
+    prerequisite value ends too late for every value of second.
+    '''
+    starts = [slot_start(d) for d in second.domain()]
+    latest = max(starts) if starts else None
+    
+    def accept(t):
+        if len(t) > len(prerequisite):
+            return check_prerequisite(t[:-1], t[-1])
+        return latest is not None and slot_end(t[-1]) < latest
+    
+    return accept
     
     
 def find_slot(name, slots):
     '''
     Return a Slot whose name is the same as the given.
     '''
+    if isinstance(slots, Calendar):
+        return slots.find_name(name)
     for s in slots:
         if s.name == name:
             return s
     return None
             
-def find_task_vars(name, vars):
-    '''
-    Return a list of task Variables whose names are the same as the given or 
-    are the subtasks of the task with the name given.
-    '''
-    result = []
-    for v in vars:
-        if v.name == name or v.name[:v.name.rfind("_")] == name:
-            result.append(v)
-    return result
-
-
 def check_prerequisite(prerequisite, second):
     '''
     Judge if candidate assignments to variables satisfy prerequisite constraint.
@@ -232,6 +295,36 @@ def check_prerequisite(prerequisite, second):
         if first[-1].time >= second[0].time:
             return False
     return True
+
+
+def slot_start(val):
+    '''
+    Return the start time of a domain value (a tuple of Slots). 
+    '''
+    return val[0].time
+
+
+def slot_end(val):
+    '''
+    Return the time of the last Slot of a domain value. 
+    '''
+    return val[-1].time
+
+
+def pack_key(var, val):
+    '''
+    Value ordering for BT.set_value_order(key=pack_key): values whose Slots 
+    already hold compatible tasks first (most shared Slots first), so the 
+    multitasking capacity is used before free Slots, then the earliest. 
+    Values that do not fit the capacity of their Slots come last.
+    '''
+    shared = 0
+    for s in val:
+        if s.get_capacity(var) <= 0:
+            return (1, 0, val[0].time)
+        if s.count:
+            shared = shared + 1
+    return (0, -shared, val[0].time)
     
     
     
@@ -410,42 +503,59 @@ class Slot:
     def __init__(self, time, pos=None):
         '''
         Create a Slot object representing a timeslot in the schedule. Maintains 
-        a list of task Variables assigned to it. 
+        the task Variables assigned to it, their number and their smallest 
+        multi, so capacity checks are O(1).
         '''
         self.time = time
-        self.assigned = []
+        self.assigned = dict()          #task Variable -> True, in order
+        self.count = 0                  #number of assigned Variables
+        self.min_multi = float("inf")   #smallest multi of assigned Variables
+        self.min_stack = []             #(Variable, min_multi before it)
         self.name = str(self.time)
         self.pos = pos
         
     def assign(self, t):
         '''Add the task Variable.'''
-        self.assigned.append(t)
+        self.assigned[t] = True
+        self.count += 1
+        self.min_stack.append((t, self.min_multi))
+        self.min_multi = min(self.min_multi, t.task.multi)
         
     def unassign(self, t):
         '''Remove the task Variable.'''
         if t in self.assigned:
-            self.assigned.remove(t)
+            del self.assigned[t]
+            self.count -= 1
+            if self.min_stack[-1][0] is t:
+                self.min_multi = self.min_stack.pop()[1]
+            else:
+                # Not the last assigned one, rebuild the stack.
+                self.min_stack, self.min_multi = [], float("inf")
+                for a in self.assigned:
+                    self.min_stack.append((a, self.min_multi))
+                    self.min_multi = min(self.min_multi, a.task.multi)
         else:
             print ("Warning: "+t.name+" is not assigned to "+self.name)
             
     def get_capacity(self, candidate=None):
         '''
         Returns the amount of space the Slot has.  If no Task has been 
-        assigned to the Slot
-
+        assigned to the Slot, inf is returned (when no candidate is given).
         '''
         if candidate:
             c_multi = candidate.task.multi
         else:
             c_multi = float("inf")
-        return min([t.task.multi for t in self.assigned]+[c_multi])-len(self.assigned)
+        return min(self.min_multi, c_multi)-self.count
 
     def next(self, slots):
         '''
-        Return the name of the Slot right after this one. Strictly follows 
+        Return the Slot right after this one. Strictly follows 
         time. So if the schedule ends at 8pm today and this slot is 8pm today,
         Slot 9pm would not be found and None is returned.
         '''
+        if isinstance(slots, Calendar):
+            return slots.next(self)
         return find_slot(str(self.time+timedelta(hours=1)), slots)
         
     def __repr__(self):
@@ -455,6 +565,654 @@ class Slot:
         
         
         
+class Calendar:
+    '''
+    Class for an indexed collection of Slots, in time order. Slots can be 
+    looked up by time or name, and the Slot right after each one is 
+    precomputed, so all lookups are O(1).
+    '''
+    def __init__(self, slots=[]):
+        '''
+        Create a Calendar object from a list of Slots sorted by time. 
+        '''
+        self.slots = list(slots)
+        self.by_time = dict((s.time, s) for s in self.slots)
+        self.by_name = dict((s.name, s) for s in self.slots)
+        self.succ = dict()
+        for s in self.slots:
+            self.succ[s] = self.by_time.get(s.time+timedelta(hours=1))
+            
+    def find(self, time):
+        '''Return the Slot starting at the given datetime, or None.'''
+        return self.by_time.get(time)
+        
+    def find_name(self, name):
+        '''Return the Slot with the given name, or None.'''
+        return self.by_name.get(name)
+        
+    def next(self, slot):
+        '''Return the Slot right after the given one, or None.'''
+        return self.succ.get(slot)
+        
+    def remove(self, slot):
+        '''Remove the given Slot, e.g., when it is no longer free.'''
+        self.slots.remove(slot)
+        del self.by_time[slot.time]
+        del self.by_name[slot.name]
+        del self.succ[slot]
+        prev = self.by_time.get(slot.time-timedelta(hours=1))
+        if prev is not None:
+            self.succ[prev] = None
+        
+    def __iter__(self):
+        return iter(self.slots)
+        
+    def __len__(self):
+        return len(self.slots)
+        
+    def __getitem__(self, i):
+        return self.slots[i]
+        
+    def __repr__(self):
+        return "Calendar" + str(self.slots)
+        
+        
+        
+def completion_hours(vars):
+    '''
+    Return a dict mapping each Variable to the list of the completion times of 
+    its domain values, in hours after the start of the earliest Slot of the 
+    domains (a task ending in that Slot completes in 1 hour).
+    '''
+    starts = [slot_start(val) for v in vars for val in v.domain()]
+    if not starts:
+        return dict()
+    origin = min(starts)
+    return dict((v, [int((slot_end(val)-origin).total_seconds())//3600+1 
+        for val in v.domain()]) for v in vars)
+        
+        
+def min_current(var, table):
+    '''
+    Return the smallest entry of table (one entry per domain value of var) 
+    over the current domain of var.
+    '''
+    if var.is_assigned():
+        return table[var.value_index(var.get_assigned_value())]
+    return min(itertools.compress(table, var.curdom))
+    
+    
+class MakespanObjective(Objective):
+    '''
+    Minimize the completion time of the last task, in hours (see 
+    completion_hours). 
+    '''
+    def __init__(self, vars):
+        Objective.__init__(self, "makespan")
+        self.vars = list(vars)
+        self.ends = completion_hours(self.vars)
+        
+    def value(self, csp):
+        return max([min_current(v, self.ends[v]) for v in self.vars] or [0])
+        
+    def lower_bound(self, csp):
+        return max([min_current(v, self.ends[v]) for v in self.vars 
+            if v.cur_domain_size()] or [0])
+        
+    def prune(self, csp, bound):
+        '''Values ending at bound or later.'''
+        pruned = []
+        for v in self.vars:
+            if not v.is_assigned():
+                for i, e in enumerate(self.ends[v]):
+                    if e >= bound and v.curdom[i]:
+                        pruned.append((v, v.dom[i]))
+        return pruned
+        
+        
+class WeightedCompletionObjective(Objective):
+    '''
+    Minimize the sum of the completion times of the tasks (see 
+    completion_hours) weighted by their priority, so urgent tasks are done 
+    first.
+    '''
+    def __init__(self, vars):
+        Objective.__init__(self, "weighted_completion")
+        self.vars = list(vars)
+        self.ends = completion_hours(self.vars)
+        
+    def value(self, csp):
+        return sum(v.task.pri*min_current(v, self.ends[v]) for v in self.vars)
+        
+    def lower_bound(self, csp):
+        return sum(v.task.pri*min_current(v, self.ends[v]) for v in self.vars 
+            if v.cur_domain_size())
+        
+    def prune(self, csp, bound):
+        '''Values whose cost, added to the smallest costs of the other 
+        tasks, reaches bound.'''
+        lb = self.lower_bound(csp)
+        pruned = []
+        for v in self.vars:
+            if not v.is_assigned() and v.cur_domain_size():
+                w = v.task.pri
+                slack = bound - lb + w*min_current(v, self.ends[v])
+                for i, e in enumerate(self.ends[v]):
+                    if w*e >= slack and v.curdom[i]:
+                        pruned.append((v, v.dom[i]))
+        return pruned
+        
+        
+class IdleGapsObjective(Objective):
+    '''
+    Minimize the number of free Slots between the start of the first task 
+    and the end of the last one. Only Slots of the domains of the Variables 
+    are counted.
+    '''
+    def __init__(self, vars):
+        Objective.__init__(self, "idle_gaps")
+        self.vars = list(vars)
+        slots = set(s for v in self.vars for val in v.domain() for s in val)
+        slots = sorted(slots, key=lambda s: s.time)
+        self.index = dict((s, i) for i, s in enumerate(slots))
+        
+    def free_slots(self):
+        '''
+        Return the number of free Slots between the first and the last Slot 
+        used by the assigned Variables, and the number of Slots the 
+        unassigned Variables will use.
+        '''
+        used, remaining = set(), 0
+        for v in self.vars:
+            if v.is_assigned():
+                used.update(self.index[s] for s in v.get_assigned_value())
+            else:
+                remaining += v.task.span
+        if not used:
+            return 0, remaining
+        return max(used)-min(used)+1-len(used), remaining
+        
+    def value(self, csp):
+        return self.free_slots()[0]
+        
+    def lower_bound(self, csp):
+        '''Unassigned tasks can fill at most as many free Slots as they 
+        use.'''
+        free, remaining = self.free_slots()
+        return max(0, free-remaining)
+        
+        
+def scheduler_objective(name, var_array):
+    '''
+    Return the Objective called name ("makespan", "weighted_completion" or 
+    "idle_gaps") over the Variables of a scheduler model, to minimize with 
+    BT.set_objective.
+    '''
+    objectives = {"makespan": MakespanObjective, 
+        "weighted_completion": WeightedCompletionObjective, 
+        "idle_gaps": IdleGapsObjective}
+    if not name in objectives:
+        print("Error: unknown objective "+str(name))
+        return None
+    return objectives[name](var_array)
+        
+        
+        
+        
+        
+class LNS:
+    '''
+    Large Neighbourhood Search over a scheduler model, for models too big to 
+    optimize with a complete branch and bound search. Starting from a 
+    solution, each iteration relaxes a neighbourhood of Variables, keeps the 
+    others fixed to their current values (see BT.set_fixed), and searches 
+    the relaxed ones for a cheaper solution under a node limit. Improvements 
+    are kept.
+    
+    Neighbourhoods:
+        "day":      the tasks in a window of days
+        "chain":    a task and the tasks linked to it by prerequisite or 
+                    subtask constraints
+        "priority": the tasks of one priority level
+    Neighbourhoods larger than max_relaxed are cut down to a random sample. 
+    All random choices use a random.Random(seed), so runs are reproducible.
+    
+    E.g.,
+        csp, vars = scheduler_csp_model(tasks, start_date, schedule)
+        lns = LNS(csp, vars, scheduler_objective("makespan", vars), seed=1)
+        result = lns.run(iterations=200)
+    '''
+    NEIGHBOURHOODS = ("day", "chain", "priority")
+    
+    def __init__(self, csp, var_array, objective, propagator=prop_FC, 
+        seed=None, node_limit=1000, max_relaxed=50, window=1, 
+        neighbourhoods=NEIGHBOURHOODS):
+        '''
+        csp, var_array: a model returned by scheduler_csp_model.
+        objective: the Objective to minimize (see scheduler_objective).
+        node_limit: decisions allowed to the search of each iteration.
+        window: number of days of the "day" neighbourhood.
+        '''
+        self.csp = csp
+        self.vars = list(var_array)
+        self.objective = objective
+        self.propagator = propagator
+        self.seed = seed
+        self.node_limit = node_limit
+        self.max_relaxed = max_relaxed
+        self.window = window
+        self.neighbourhoods = list(neighbourhoods)
+        self.bt = BT(csp)
+        self.current = None     #current solution, Variable -> value
+        self.cost = None        #and its cost
+        self.stats = []         #one dict per iteration
+        
+    def run(self, iterations=100, time_limit=None, initial=None, 
+        verbose=False):
+        '''
+        Run LNS for a number of iterations, or until time_limit seconds have 
+        passed. initial is a solution to start from (a dict mapping every 
+        Variable to a value), else the first solution BT finds is used.
+        
+        Return a SearchResult with the best solution found, whose Variables 
+        are also left assigned to it, or the result of the first search if 
+        it found no solution. self.stats holds, for each iteration, a dict 
+        with the neighbourhood used, the number of relaxed Variables, the 
+        status of the search, the cost before and after, and the search 
+        statistics.
+        '''
+        rng = random.Random(self.seed)
+        stime, wtime = time.process_time(), time.perf_counter()
+        nDecisions, nPrunings = 0, 0
+        self.stats = []
+        bt = self.bt
+        
+        bt.set_fixed(initial)
+        bt.set_objective(None)
+        bt.set_limits(time_limit=time_limit)
+        result = bt.solve(self.propagator)
+        if not result.is_solved():
+            return result
+        nDecisions, nPrunings = result.nDecisions, result.nPrunings
+        self.current = dict(result.assignment)
+        self.cost = self.objective.value(self.csp)
+        if verbose:
+            print("LNS start, {} = {}".format(self.objective.name, self.cost))
+        
+        for i in range(iterations):
+            elapsed = time.perf_counter()-wtime
+            if time_limit is not None and elapsed >= time_limit:
+                break
+            kind = rng.choice(self.neighbourhoods)
+            relaxed = self.neighbourhood(kind, rng)
+            before = self.cost
+            
+            fixed = dict((v, val) for v, val in self.current.items() 
+                if not v in relaxed)
+            bt.set_fixed(fixed)
+            bt.set_objective(self.objective, self.cost)
+            bt.set_restarts(seed=rng.randrange(1 << 30))
+            bt.set_limits(max_decisions=self.node_limit, 
+                time_limit=None if time_limit is None else time_limit-elapsed)
+            result = bt.solve(self.propagator)
+            nDecisions += result.nDecisions
+            nPrunings += result.nPrunings
+            
+            if result.is_solved():
+                self.current = dict(result.assignment)
+                self.cost = result.cost
+            self.restore()
+            
+            self.stats.append({"iteration": i, "neighbourhood": kind, 
+                "relaxed": len(relaxed), "status": result.status, 
+                "before": before, "cost": self.cost, 
+                "improvement": before-self.cost, 
+                "decisions": result.nDecisions, 
+                "prunings": result.nPrunings, 
+                "cpu_time": result.cpu_time})
+            if verbose:
+                print("LNS iteration {}: {} {} relaxed, {} = {}".format(i, 
+                    kind, len(relaxed), self.objective.name, self.cost))
+                
+        bt.set_fixed(None)
+        bt.set_objective(None)
+        bt.set_restarts()
+        bt.set_limits()
+        return SearchResult(SearchResult.SOLVED, dict(self.current), 
+            time.process_time()-stime, time.perf_counter()-wtime, 
+            nDecisions, nPrunings, self.cost)
+        
+    def restore(self):
+        '''Assign the Variables to the current solution.'''
+        for v in self.vars:
+            if v.is_assigned():
+                v.unassign()
+        for v in self.vars:
+            v.assign(self.current[v])
+            
+    def neighbourhood(self, kind, rng):
+        '''
+        Return the set of Variables to relax, for a neighbourhood of the kind 
+        given.
+        '''
+        if kind == "day":
+            days = sorted(set(slot_start(val).date() 
+                for val in self.current.values()))
+            first = rng.choice(days)
+            last = first+timedelta(days=self.window)
+            relaxed = [v for v in self.vars 
+                if any(first <= s.time.date() < last for s in self.current[v])]
+        elif kind == "chain":
+            relaxed = self.chain(rng.choice(self.vars))
+        elif kind == "priority":
+            pri = rng.choice(sorted(set(v.task.pri for v in self.vars)))
+            relaxed = [v for v in self.vars if v.task.pri == pri]
+        else:
+            print("Error: unknown neighbourhood "+str(kind))
+            relaxed = []
+        if len(relaxed) > self.max_relaxed:
+            relaxed = rng.sample(relaxed, self.max_relaxed)
+        return set(relaxed)
+        
+    def chain(self, var):
+        '''
+        Return the Variables reachable from var through constraints other 
+        than the multitasking one, in breadth first order, at most 
+        max_relaxed of them.
+        '''
+        chain, seen = [var], set([var])
+        for v in chain:
+            for c in self.csp.get_cons_with_var(v):
+                if isinstance(c, CumulativeConstraint):
+                    continue
+                for u in c.get_scope():
+                    if not u in seen and len(chain) < self.max_relaxed:
+                        seen.add(u)
+                        chain.append(u)
+        return chain
+        
+        
+class IncrementalScheduler:
+    '''
+    Scheduler model that can be edited after it is solved. Edits (adding or 
+    removing a task, blocking a Slot, changing a due date) only rebuild the 
+    Variables of the tasks they affect and the constraints over them, and 
+    solve repairs the previous solution locally instead of solving from 
+    scratch:
+        1. Variables whose previous value is still in their domain are fixed 
+           to it (see BT.set_fixed), and the others are searched.
+        2. If that fails within node_limit decisions, the Variables linked 
+           to them by constraints and the Variables whose previous values 
+           are on the days of their domains are searched as well, and so on 
+           until their domains hold enough free Slots (see neighbourhood).
+        3. Otherwise all Variables are searched, trying the previous values 
+           first (see BT.set_hints).
+    
+    The model is the same as the one of scheduler_csp_model, without the 
+    extensional option.
+    
+    E.g.,
+        sched = IncrementalScheduler(tasks, start_date, schedule)
+        sched.solve()
+        sched.add_task(Task("new", due))
+        sched.block_slot(datetime(2016, 1, 2, 9), 'L')
+        sched.solve()
+        board = sched.board()
+    '''
+    def __init__(self, tasks_list, start_date, initial_schedule, start_hrs=[], 
+        propagator=prop_FC, alldiff_mode="gac", node_limit=1000):
+        '''
+        The inputs are the same as the ones of scheduler_csp_model. 
+        propagator is used by solve, and node_limit bounds the decisions of 
+        the local repairs.
+        '''
+        self.schedule = deepcopy(initial_schedule)
+        self.slots = init_slots(start_date, self.schedule, start_hrs)
+        self.propagator = propagator
+        self.alldiff_mode = alldiff_mode
+        self.node_limit = node_limit
+        self.csp = CSP("ScheduleCSP")
+        self.bt = BT(self.csp)
+        self.tasks = dict()       #name -> Task, in search order
+        self.task_vars = dict()   #name -> Variables of the task
+        self.task_cons = dict()   #name -> constraints the task owns
+        self.multitask = None     #the CumulativeConstraint
+        self.solution = dict()    #Variable name -> value of last solution
+        self.stage = None         #repair stage of the last solve
+        
+        tasks = list(tasks_list)
+        tasks.sort(key=lambda x:(-x.pri,x.due))
+        for t in tasks:
+            self.tasks[t.name] = t
+        self.rebuild(self.tasks)
+        
+    def add_task(self, task):
+        '''Add a Task to the model.'''
+        if task.name in self.tasks:
+            print("Error: task "+task.name+" is already scheduled")
+            return
+        self.tasks[task.name] = task
+        self.rebuild([task.name])
+        
+    def remove_task(self, name):
+        '''Remove the Task called name from the model.'''
+        if not name in self.tasks:
+            print("Error: no task "+str(name))
+            return
+        del self.tasks[name]
+        self.rebuild([name])
+        
+    def change_due(self, name, due):
+        '''Change the due datetime of the Task called name.'''
+        if not name in self.tasks:
+            print("Error: no task "+str(name))
+            return
+        t = copy(self.tasks[name])
+        t.due = due
+        self.tasks[name] = t
+        self.rebuild([name])
+        
+    def block_slot(self, time, mark='L'):
+        '''
+        Turn the free Slot starting at the datetime time into a pre-set 
+        lecture or break (mark 'L' or 'B').
+        '''
+        slot = self.slots.find(time)
+        if slot is None:
+            print("Error: no free Slot at "+str(time))
+            return
+        self.schedule[slot.pos[0]][slot.pos[1]] = mark
+        self.unassign()
+        self.slots.remove(slot)
+        self.rebuild([name for name, vars in self.task_vars.items() 
+            if any(slot in val for v in vars for val in v.dom)])
+        
+    def solve(self, time_limit=1):
+        '''
+        Solve the model, repairing the previous solution (see the class 
+        description). Return a SearchResult with the statistics of all the 
+        stages run. The Variables are left assigned to the solution found.
+        
+        time_limit bounds the whole solve, in seconds (None for no limit). 
+        If the last stage reaches it the result is UNKNOWN, with the deepest 
+        partial assignment found (see BT.set_limits).
+        '''
+        stime, wtime = time.process_time(), time.perf_counter()
+        nDecisions, nPrunings = 0, 0
+        vars = self.csp.get_all_vars()
+        hints = dict()
+        for v in vars:
+            val = self.solution.get(v.name)
+            if val is not None and val in v.dom_index:
+                hints[v] = val
+        relaxed = set(v for v in vars if not v in hints)
+        
+        stages = []
+        if hints:
+            stages.append((relaxed, self.node_limit))
+            wider = self.neighbourhood(relaxed)
+            if len(wider) > len(relaxed) and len(wider) < len(vars):
+                stages.append((wider, self.node_limit))
+        stages.append((set(vars), None))
+        
+        bt = self.bt
+        bt.set_hints(hints)
+        for i, (free, limit) in enumerate(stages):
+            elapsed = time.perf_counter()-wtime
+            bt.set_fixed(dict((v, val) for v, val in hints.items() 
+                if not v in free))
+            bt.set_limits(max_decisions=limit, time_limit=None 
+                if time_limit is None else max(0, time_limit-elapsed))
+            result = bt.solve(self.propagator)
+            nDecisions += result.nDecisions
+            nPrunings += result.nPrunings
+            self.stage = i+1
+            if result.is_solved() or limit is None:
+                break
+            self.unassign()
+                
+        bt.set_fixed(None)
+        bt.set_hints(None)
+        bt.set_limits()
+        if result.is_solved():
+            self.solution = dict((v.name, val) 
+                for v, val in result.assignment.items())
+        return SearchResult(result.status, result.assignment, 
+            time.process_time()-stime, time.perf_counter()-wtime, 
+            nDecisions, nPrunings)
+            
+    def board(self):
+        '''Return the schedule with the assigned tasks (see apply_sol).'''
+        return apply_sol(self.schedule, self.csp)
+        
+    def unassign(self):
+        '''Unassign all Variables, freeing their Slots.'''
+        for v in self.csp.get_all_vars():
+            if v.is_assigned():
+                v.unassign()
+                
+    def neighbourhood(self, relaxed):
+        '''
+        Return relaxed with the Variables sharing a constraint other than 
+        the multitasking one with them, and the Variables whose previous 
+        value is on a day of the current domain of one of them, so they can 
+        make room for it. The Variables added can in turn need room, so the 
+        days of their domains are added as well, until the domains hold at 
+        least one Slot free in the previous solution per Variable of 
+        relaxed.
+        '''
+        wider = set(relaxed)
+        for v in relaxed:
+            for c in self.csp.get_cons_with_var(v):
+                if not c is self.multitask:
+                    wider.update(c.get_scope())
+        by_day = dict()
+        used = set()
+        for v in self.csp.get_all_vars():
+            val = self.solution.get(v.name)
+            if val is not None and val in v.dom_index:
+                used.update(val)
+                for day in set(s.time.date() for s in val):
+                    by_day.setdefault(day, []).append(v)
+        days, reach = set(), set()
+        frontier = list(wider)
+        while frontier:
+            new_days = set()
+            for v in frontier:
+                for val in v.cur_domain():
+                    for s in val:
+                        if not s in reach:
+                            reach.add(s)
+                            new_days.add(s.time.date())
+            if len(reach-used) >= len(relaxed):
+                break
+            frontier = []
+            for day in new_days-days:
+                frontier.extend(v for v in by_day.get(day, []) 
+                    if not v in wider)
+            days.update(new_days)
+            wider.update(frontier)
+        return wider
+        
+    def rebuild(self, names):
+        '''
+        Rebuild the Variables of the named tasks (removing those no longer 
+        in self.tasks), and the constraints over them.
+        '''
+        names = set(names)
+        relink = [n for n in self.tasks if n in names or 
+            any(t0.name in names for t0 in self.tasks[n].order)]
+        self.unassign()
+        multitask = self.multitask
+        if multitask is not None:
+            self.csp.remove_constraint(multitask)
+            self.multitask = None
+        for n in relink:
+            for c in self.task_cons.pop(n, []):
+                self.csp.remove_constraint(c)
+        removed, added = [], []
+        for n in names:
+            for c in self.task_cons.pop(n, []):
+                self.csp.remove_constraint(c)
+            for v in self.task_vars.pop(n, []):
+                self.csp.remove_var(v)
+                removed.append(v)
+        for n in self.tasks:
+            if n in names:
+                self.task_vars[n] = task_variables(self.tasks[n], self.slots)
+                pos = self.position(self.tasks[n])
+                for i, v in enumerate(self.task_vars[n]):
+                    self.csp.add_var(v, pos+i)
+                    added.append(v)
+        for n in relink:
+            self.link(n)
+        if self.csp.vars:
+            # Reuse the resource index of the previous constraint.
+            if multitask is None:
+                multitask = CumulativeConstraint("multitask", self.csp.vars)
+            else:
+                multitask = multitask.rescoped(removed, added)
+            self.multitask = multitask
+            self.csp.add_constraint(self.multitask)
+            
+    def position(self, task):
+        '''
+        Return the index of csp.vars where the Variables of task go: after 
+        the Variables of the tasks before it in the order of 
+        scheduler_csp_model, (-priority, due).
+        '''
+        key = (-task.pri, task.due)
+        vars = self.csp.vars
+        lo, hi = 0, len(vars)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if key < (-vars[mid].task.pri, vars[mid].task.due):
+                hi = mid
+            else:
+                lo = mid+1
+        return lo
+            
+    def link(self, name):
+        '''
+        Add the constraints owned by the task called name: its subtasks in 
+        different Slots, and its prerequisites before it.
+        '''
+        t, vars = self.tasks[name], self.task_vars[name]
+        cons = []
+        if len(vars) > 1:
+            cons.append(AllDiffConstraint("no_duplicate_"+name, vars, 
+                self.alldiff_mode, slot_start))
+        for var in vars:
+            for t0 in t.order:
+                t0_vars = self.task_vars.get(t0.name)
+                if t0_vars:
+                    cons.append(PrecedenceConstraint(t0.name+"_before_"+name, 
+                        t0_vars, var, slot_start, slot_end))
+        for c in cons:
+            self.csp.add_constraint(c)
+        self.task_cons[name] = cons
+        
+        
 if __name__ == '__main__':
     print ("\n##########Task class test##########")
     # Task object example initialization here:
@@ -1,4 +1,5 @@
 from scheduler_csp import *
+from parallel import *
 import copy
 from random import shuffle
 
@@ -523,11 +524,596 @@ def solution_optimization_testing():
 
 
 
+def valid_solution(csp):
+    '''
+    Return True if every constraint of csp has its variables assigned and
+    is satisfied by their values. Prints the first problem found.
+    '''
+    for c in csp.get_all_cons():
+        vals = [v.get_assigned_value() for v in c.get_scope()]
+        if(None in vals):
+            print('Error: constraint '+c.name+' has unassigned variables!')
+            return False
+        if(not(c.check(vals))):
+            print('Error: constraint '+c.name+' is violated!')
+            return False
+    return True
+
+
+def compare_searches(runs):
+    '''
+    runs = list of [label, csp, result] for searches of the same problem,
+    each on its own copy of the model.
+
+    checking:
+    1. all searches agree on SAT/UNSAT
+    2. searches that proved optimality agree on the cost
+    3. every solution found is valid
+    '''
+    failed = False
+    [label0, csp0, result0] = runs[0]
+    optimal = [r for [l, c, r] in runs if r.optimal]
+    for [label, csp, result] in runs:
+        print(label+': '+repr(result))
+        if(result.status != result0.status):
+            failed = True
+            print('Error: '+label+' and '+label0+' do not agree on SAT/UNSAT!')
+        if(result.optimal and result.cost != optimal[0].cost):
+            failed = True
+            print('Error: '+label+' found another optimal cost!')
+        if(result.is_solved() and not(valid_solution(csp))):
+            failed = True
+            print('Error: '+label+' returned an invalid solution!')
+
+    if(not(failed)):
+        print('SUCCESS')
+    else:
+        print('SOME FAILURES')
+    return failed
+
+
+def alldiff_testing():
+    '''
+    Tasks broken into subtasks get one AllDiffConstraint each. Checks that
+    both alldiff modes (Regin's matching and Hall intervals) agree with
+    each other under every propagator.
+    '''
+    propagators = [prop_BT, prop_FC, prop_GAC]
+
+    print('alldiff_testing 1 (gac/bounds modes) Starts. ')
+    old1 = compose_initial_schedule(4, 6)
+    [tasks1, duration1] = compose_tasks_for_deadline_testing(old1, datetime(2016, 1, 1, 0), 1, 2)
+    runs = []
+    for mode in ["gac", "bounds"]:
+        for prop in propagators:
+            csp1 = scheduler_csp_model(copy.deepcopy(tasks1), datetime(2016, 1, 1), old1, alldiff_mode = mode)
+            runs.append([mode+' '+prop.__name__, csp1[0], BT(csp1[0]).solve(prop)])
+    compare_searches(runs)
+
+    print('alldiff_testing 2 (gac/bounds modes, invalid input) Starts. ')
+    old2 = compose_initial_schedule(3, 4)
+    [tasks2, duration2] = compose_tasks_for_deadline_testing(old2, datetime(2016, 1, 1, 0), 1, 2, invalid = 1)
+    runs = []
+    for mode in ["gac", "bounds"]:
+        for prop in propagators:
+            csp2 = scheduler_csp_model(copy.deepcopy(tasks2), datetime(2016, 1, 1), old2, alldiff_mode = mode)
+            runs.append([mode+' '+prop.__name__, csp2[0], BT(csp2[0]).solve(prop)])
+    compare_searches(runs)
+    if(runs[0][2].status != SearchResult.UNSAT):
+        print('Error: invalid input was scheduled!')
+
+    #Tasks of a single subtask need no AllDiffConstraint.
+    print('alldiff_testing 3 (unsplit tasks) Starts. ')
+    old3 = compose_initial_schedule(4, 4)
+    [tasks3, duration3] = compose_tasks_for_deadline_testing(old3, datetime(2016, 1, 1, 0), 1, 1)
+    csp3 = scheduler_csp_model(tasks3, datetime(2016, 1, 1), old3)
+    if([c for c in csp3[0].get_all_cons() if c.name.startswith('no_duplicate_')]):
+        print('SOME FAILURES')
+    else:
+        print('SUCCESS')
+
+
+def precedence_testing():
+    '''
+    Prerequisites are PrecedenceConstraints, or tables in the extensional
+    model. Checks that both models agree under every propagator, on a
+    chain of prerequisites, on a chain too long for its due date and on
+    a cycle of prerequisites.
+    '''
+    propagators = [prop_BT, prop_FC, prop_GAC]
+    old = compose_initial_schedule(3, 6, 2)
+
+    def chain(due, cycle = False):
+        a = Task("a", datetime(2016, 1, 3, 23), 2, False, 1)
+        b = Task("b", datetime(2016, 1, 3, 23), 3, True, 1, [a])
+        c = Task("c", due, 1, False, 1, [a, b])
+        if(cycle):
+            a.order = [c]
+        return [c, b, a]
+
+    tests = [['chain', chain(datetime(2016, 1, 3, 23)), SearchResult.SOLVED],
+             ['late chain', chain(datetime(2016, 1, 1, 20)), SearchResult.UNSAT],
+             ['cycle', chain(datetime(2016, 1, 3, 23), True), SearchResult.UNSAT]]
+    for [name, tasks, status] in tests:
+        print('precedence_testing ('+name+') Starts. ')
+        runs = []
+        for extensional in [False, True]:
+            for prop in propagators:
+                csp = scheduler_csp_model(tasks, datetime(2016, 1, 1), old, extensional = extensional)
+                label = ('table ' if extensional else '')+prop.__name__
+                runs.append([label, csp[0], BT(csp[0]).solve(prop)])
+        compare_searches(runs)
+        if(runs[0][2].status != status):
+            print('Error: expected '+status+'!')
+
+
+def table_testing():
+    '''
+    The extensional model stores every constraint as a table. Checks that
+    it agrees with the default model under every propagator, including
+    forward checking on the tables and Compact-Table.
+    '''
+    propagators = [prop_BT, prop_FC, prop_GAC, prop_CT]
+
+    tests = [['table_testing 1', compose_initial_schedule(3, 6), 2, 0],
+             ['table_testing 2 (invalid input)', compose_initial_schedule(3, 4), 1, 1]]
+    for [name, old, multiplicity, invalid] in tests:
+        print(name+' Starts. ')
+        [tasks, duration] = compose_tasks_for_deadline_testing(old, datetime(2016, 1, 1, 0), multiplicity, 2, invalid = invalid)
+        csp = scheduler_csp_model(copy.deepcopy(tasks), datetime(2016, 1, 1), old)
+        runs = [['prop_GAC', csp[0], BT(csp[0]).solve(prop_GAC)]]
+        for prop in propagators:
+            csp = scheduler_csp_model(copy.deepcopy(tasks), datetime(2016, 1, 1), old, extensional = True)
+            runs.append(['table '+prop.__name__, csp[0], BT(csp[0]).solve(prop)])
+        compare_searches(runs)
+
+
+def cumulative_testing():
+    '''
+    The multitasking constraint lets a Slot hold as many tasks as the
+    smallest multi among them. Tasks that can share Slots are mixed with
+    tasks that cannot, and every propagator must agree, including GAC
+    with restarts, which backtracks the timetable kept by the constraint
+    across many branches.
+    '''
+    propagators = [prop_BT, prop_FC, prop_GAC, prop_CT]
+    old = compose_initial_schedule(2, 6, 2)
+
+    def shared(n_multi, n_single):
+        due = datetime(2016, 1, 2, 23)
+        tasks = [Task("m"+str(i), due, 2, True, 2) for i in range(n_multi)]
+        return tasks + [Task("s"+str(i), due, 1, False, 1) for i in range(n_single)]
+
+    tests = [['fits', 3, 3, SearchResult.SOLVED],
+             ['one task too many', 2, 5, SearchResult.UNSAT]]
+    for [name, n_multi, n_single, status] in tests:
+        print('cumulative_testing ('+name+') Starts. ')
+        runs = []
+        for prop in propagators:
+            csp = scheduler_csp_model(shared(n_multi, n_single), datetime(2016, 1, 1), old)
+            runs.append([prop.__name__, csp[0], BT(csp[0]).solve(prop)])
+        csp = scheduler_csp_model(shared(n_multi, n_single), datetime(2016, 1, 1), old)
+        bt = BT(csp[0])
+        bt.set_var_heuristic("dom/wdeg")
+        bt.set_restarts("luby", seed = 1)
+        runs.append(['prop_GAC luby', csp[0], bt.solve(prop_GAC)])
+        compare_searches(runs)
+        if(runs[0][2].status != status):
+            print('Error: expected '+status+'!')
+
+
+def restart_testing():
+    '''
+    Restarts randomize the value order, so the schedule found may change,
+    but not whether there is one. Checks luby and geometric restarts
+    against the search without restarts, and that a search finished after
+    some restarts leaves no unexplored subtrees of the runs cut off.
+    '''
+    tests = [['restart_testing 1', compose_initial_schedule(4, 6), 2, 0],
+             ['restart_testing 2 (invalid input)', compose_initial_schedule(3, 4), 1, 1]]
+    for [name, old, multiplicity, invalid] in tests:
+        print(name+' Starts. ')
+        [tasks, duration] = compose_tasks_for_deadline_testing(old, datetime(2016, 1, 1, 0), multiplicity, 2, invalid = invalid)
+        runs = []
+        for prop in [prop_FC, prop_GAC]:
+            for [policy, seed] in [[None, None], ["luby", 1], ["geometric", 2]]:
+                csp = scheduler_csp_model(copy.deepcopy(tasks), datetime(2016, 1, 1), old)
+                bt = BT(csp[0])
+                bt.set_restarts(policy, seed = seed)
+                runs.append([prop.__name__+' '+str(policy), csp[0], bt.solve(prop)])
+                if(bt.open_nodes):
+                    print('Error: '+runs[-1][0]+' left open nodes after '+str(bt.nRestarts)+' restarts!')
+        compare_searches(runs)
+
+
+def brute_force_optimum(csp, objective):
+    '''
+    Return the smallest cost of objective over every solution of csp,
+    enumerating all the assignments (None if csp has no solution). Only
+    for tiny problems.
+    '''
+    vars = csp.get_all_vars()
+    best = [None]
+
+    def extend(i):
+        if(i == len(vars)):
+            for c in csp.get_all_cons():
+                if(not(c.check([v.get_assigned_value() for v in c.get_scope()]))):
+                    return
+            cost = objective.value(csp)
+            if(best[0] is None or cost < best[0]):
+                best[0] = cost
+            return
+        for val in vars[i].domain():
+            if(vars[i].assign(val)):
+                extend(i + 1)
+                vars[i].unassign()
+
+    extend(0)
+    return best[0]
+
+
+def branch_and_bound_testing():
+    '''
+    Minimizes each objective of scheduler_objective by branch and bound
+    under every propagator, and checks the optimal cost against the one
+    found by enumerating all the schedules. With the optimal cost as
+    bound, no schedule is left.
+    '''
+    propagators = [prop_BT, prop_FC, prop_GAC]
+    old = compose_initial_schedule(2, 6, 2)
+    a = Task("a", datetime(2016, 1, 2, 23), 2, True, 1, priority = 1)
+    b = Task("b", datetime(2016, 1, 2, 23), 1, False, 2, [a], priority = 3)
+    c = Task("c", datetime(2016, 1, 2, 23), 2, False, 1, priority = 2)
+
+    for name in ["makespan", "weighted_completion", "idle_gaps"]:
+        print('branch_and_bound_testing ('+name+') Starts. ')
+        csp = scheduler_csp_model(copy.deepcopy([a, b, c]), datetime(2016, 1, 1), old)
+        optimum = brute_force_optimum(csp[0], scheduler_objective(name, csp[1]))
+        print('Enumerated optimum: '+str(optimum))
+        runs = []
+        for prop in propagators:
+            csp = scheduler_csp_model(copy.deepcopy([a, b, c]), datetime(2016, 1, 1), old)
+            bt = BT(csp[0])
+            bt.set_objective(scheduler_objective(name, csp[1]))
+            runs.append([prop.__name__, csp[0], bt.solve(prop)])
+        compare_searches(runs)
+        for [label, csp0, result] in runs:
+            if(not(result.optimal) or result.cost != optimum):
+                print('Error: '+label+' did not find the optimum!')
+
+        for prop in propagators:
+            csp = scheduler_csp_model(copy.deepcopy([a, b, c]), datetime(2016, 1, 1), old)
+            bt = BT(csp[0])
+            bt.set_objective(scheduler_objective(name, csp[1]), optimum)
+            if(bt.solve(prop).status != SearchResult.UNSAT):
+                print('Error: '+prop.__name__+' found a schedule better than the optimum!')
+
+
+def lns_testing():
+    '''
+    LNS keeps the tasks out of the neighbourhood fixed to their current
+    Slots. Checks that it only improves on the first schedule found and
+    returns a valid one, and that fixed values breaking a constraint among
+    themselves are rejected by every propagator.
+    '''
+    print('lns_testing 1 Starts. ')
+    old1 = compose_initial_schedule(4, 6)
+    [tasks1, duration1] = compose_tasks_for_deadline_testing(old1, datetime(2016, 1, 1, 0), 2, 2)
+    failed = False
+    for name in ["makespan", "weighted_completion", "idle_gaps"]:
+        csp1 = scheduler_csp_model(copy.deepcopy(tasks1), datetime(2016, 1, 1), old1)
+        objective = scheduler_objective(name, csp1[1])
+        lns = LNS(csp1[0], csp1[1], objective, seed = 1, node_limit = 100)
+        result = lns.run(iterations = 20)
+        print(name+': '+repr(result))
+        if(not(result.is_solved()) or not(valid_solution(csp1[0]))):
+            failed = True
+            print('Error: LNS returned no valid schedule!')
+        elif(result.cost != objective.value(csp1[0]) or result.cost > lns.stats[0]["before"]):
+            failed = True
+            print('Error: LNS made the schedule worse!')
+    if(not(failed)):
+        print('SUCCESS')
+    else:
+        print('SOME FAILURES')
+
+    #a_0 and a_1 in the same Slot, b before its prerequisite a, and a_0
+    #and a_1 in the same Slot with a_2 left free.
+    print('lns_testing 2 (infeasible fixed values) Starts. ')
+    old2 = compose_initial_schedule(2, 6, 2)
+    failed = False
+    for case in [0, 1, 2]:
+        for prop in [prop_BT, prop_FC, prop_GAC]:
+            a = Task("a", datetime(2016, 1, 2, 23), 3 if case == 2 else 2, True, 2)
+            b = Task("b", datetime(2016, 1, 2, 23), 1, False, 1, [a])
+            csp2 = scheduler_csp_model([a, b], datetime(2016, 1, 1), old2)
+            by_name = dict((v.name, v) for v in csp2[1])
+            [a_0, a_1, b] = [by_name["a_0"], by_name["a_1"], by_name["b"]]
+            if(case == 0):
+                fixed = {a_0: a_0.domain()[0], a_1: a_1.domain()[0], b: b.domain()[-1]}
+            elif(case == 1):
+                fixed = {a_0: a_0.domain()[-1], a_1: a_1.domain()[-2], b: b.domain()[0]}
+            else:
+                fixed = {a_0: a_0.domain()[0], a_1: a_1.domain()[0]}
+            bt = BT(csp2[0])
+            bt.set_fixed(fixed)
+            lns = LNS(csp2[0], csp2[1], scheduler_objective("makespan", csp2[1]), prop)
+            if(bt.solve(prop).status != SearchResult.UNSAT or (case != 2 and 
+               lns.run(iterations = 5, initial = fixed).status != SearchResult.UNSAT)):
+                failed = True
+                print('Error: '+prop.__name__+' accepted infeasible fixed values!')
+    if(not(failed)):
+        print('SUCCESS')
+    else:
+        print('SOME FAILURES')
+
+
+def incremental_testing():
+    '''
+    Edits an IncrementalScheduler and checks after each edit that the
+    repaired schedule is valid and agrees with a model built from scratch
+    on SAT/UNSAT, that removing a task repairs without search, and that
+    the Variables stay in the search order of scheduler_csp_model.
+    '''
+    print('incremental_testing Starts. ')
+    old = compose_initial_schedule(4, 6, 2)
+    a = Task("a", datetime(2016, 1, 4, 23), 2, True, 1)
+    b = Task("b", datetime(2016, 1, 4, 23), 1, False, 2, [a])
+    c = Task("c", datetime(2016, 1, 2, 23), 2, False, 1, priority = 2)
+    d = Task("d", datetime(2016, 1, 3, 23), 3, True, 1)
+    sched = IncrementalScheduler([a, b, c, d], datetime(2016, 1, 1), old)
+    result = sched.solve()
+    failed = False
+
+    #"extra" needs 6 Slots on the first day, which has only 3 free.
+    edits = [['add', lambda: sched.add_task(Task("urgent", datetime(2016, 1, 2, 23), 2, True, 1, priority = 3))],
+             ['remove', lambda: sched.remove_task("c")],
+             ['change_due', lambda: sched.change_due("d", datetime(2016, 1, 2, 23))],
+             ['block_slot', lambda: sched.block_slot(slot_start(result.assignment[sched.csp.vars[0]]), 'B')],
+             ['add too many', lambda: sched.add_task(Task("extra", datetime(2016, 1, 1, 23), 6, True, 1))]]
+    for [name, edit] in edits:
+        edit()
+        result = sched.solve()
+        csp = scheduler_csp_model(list(sched.tasks.values()), datetime(2016, 1, 1), sched.schedule)
+        print(name+' (stage '+str(sched.stage)+'): ')
+        failed = compare_searches([['incremental', sched.csp, result], 
+            ['scratch', csp[0], BT(csp[0]).solve(prop_FC)]]) or failed
+        if(name == 'remove' and (sched.stage != 1 or result.nDecisions != 0)):
+            failed = True
+            print('Error: removing a task was not repaired without search!')
+        keys = [(-v.task.pri, v.task.due) for v in sched.csp.get_all_vars()]
+        if(keys != sorted(keys)):
+            failed = True
+            print('Error: Variables out of search order after '+name+'!')
+    if(result.status != SearchResult.UNSAT):
+        failed = True
+        print('Error: too many tasks were scheduled!')
+
+    if(not(failed)):
+        print('SUCCESS')
+    else:
+        print('SOME FAILURES')
+
+
+def parallel_testing():
+    '''
+    The parallel searches rebuild the model in every worker and map the
+    solution back to the Variables of the caller's model. Checks the
+    portfolio and the tree search against the sequential search on a
+    satisfiable and an unsatisfiable input, the optimum found by the
+    parallel branch and bound, and that a time limit gives UNKNOWN.
+    '''
+    old1 = compose_initial_schedule(3, 6)
+    [tasks1, duration1] = compose_tasks_for_deadline_testing(old1, datetime(2016, 1, 1, 0), 1, 2)
+    old2 = compose_initial_schedule(2, 6, 2)
+    a = Task("a", datetime(2016, 1, 2, 23), 2, True, 1)
+    b = Task("b", datetime(2016, 1, 2, 23), 1, False, 2, [a])
+    c = Task("c", datetime(2016, 1, 2, 23), 2, False, 1)
+    #a, b, c and d need 8 Slots, only 6 are free.
+    d = Task("d", datetime(2016, 1, 1, 23), 3, True, 1)
+
+    tests = [['parallel_testing 1', ModelSpec(tasks1, datetime(2016, 1, 1), old1), {}],
+             ['parallel_testing 2 (invalid input)', ModelSpec([a, b, c, d], datetime(2016, 1, 1), old2), {}],
+             ['parallel_testing 3 (makespan)', ModelSpec([a, b, c], datetime(2016, 1, 1), old2), {"objective": "makespan"}]]
+    for [name, spec, config] in tests:
+        print(name+' Starts. ')
+        csp = spec.build()
+        bt = BT(csp[0])
+        configure(bt, config, csp[1])
+        runs = [['sequential', csp[0], bt.solve(prop_FC)]]
+        if(not(config)):
+            csp = portfolio_solve(spec, processes = 2)
+            runs.append(['portfolio', csp[0], csp[2]])
+        csp = parallel_solve(spec, config, processes = 2, node_limit = 5)
+        runs.append(['tree', csp[0], csp[2]])
+        compare_searches(runs)
+        if(config and not(runs[-1][2].optimal)):
+            print('Error: the tree search did not prove optimality!')
+
+    print('parallel_testing 4 (time limit) Starts. ')
+    old4 = compose_initial_schedule(5, 4)
+    [tasks4, duration4] = compose_tasks_for_deadline_testing(old4, datetime(2016, 1, 1, 0), 1, 2, invalid = 1)
+    spec = ModelSpec(tasks4, datetime(2016, 1, 1), old4)
+    results = [portfolio_solve(spec, processes = 2, time_limit = 0.5)[2], 
+               parallel_solve(spec, processes = 2, time_limit = 0.5)[2]]
+    if([r.status for r in results] != [SearchResult.UNKNOWN, SearchResult.UNKNOWN]):
+        print('Error: a search did not stop at its time limit!')
+        print('SOME FAILURES')
+    else:
+        print('SUCCESS')
+
+
+
+def value_order_testing():
+    '''
+    The value orderings only change the order in which the values are
+    tried. Checks that lcv and pack_key try the Slot shared with a fixed
+    task first, unlike the domain order, and that every ordering finds a
+    valid schedule, with and without a seeded search.
+    '''
+    orders = [['domain', 'domain', None], ['lcv', 'lcv', None], ['pack', 'domain', pack_key]]
+
+    #m1 fits in the last free Slot of the first day with m0, and s cannot.
+    print('value_order_testing 1 (value sequence) Starts. ')
+    old1 = compose_initial_schedule(2, 6, 2)
+    failed = False
+    for [label, ordering, key] in orders:
+        m0 = Task("m0", datetime(2016, 1, 2, 23), 1, False, 2)
+        m1 = Task("m1", datetime(2016, 1, 1, 23), 1, False, 2)
+        s = Task("s", datetime(2016, 1, 2, 23), 1, False, 1)
+        csp1 = scheduler_csp_model([m0, m1, s], datetime(2016, 1, 1), old1)
+        by_name = dict((v.name, v) for v in csp1[1])
+        shared = by_name["m1"].domain()[-1]
+        bt = BT(csp1[0])
+        bt.set_value_order(ordering, key)
+        bt.set_fixed({by_name["m0"]: shared})
+        first = bt.split(prop_FC, 2)[0]
+        if((first[0][1] == shared) != (label != 'domain')):
+            failed = True
+            print('Error: '+label+' tried '+str(slot_start(first[0][1]))+' first!')
+    if(not(failed)):
+        print('SUCCESS')
+    else:
+        print('SOME FAILURES')
+
+    print('value_order_testing 2 Starts. ')
+    old2 = compose_initial_schedule(4, 6)
+    [tasks2, duration2] = compose_tasks_for_deadline_testing(old2, datetime(2016, 1, 1, 0), 2, 2)
+    runs = []
+    for prop in [prop_FC, prop_GAC]:
+        for [label, ordering, key] in orders:
+            for seed in [None, 1]:
+                csp2 = scheduler_csp_model(copy.deepcopy(tasks2), datetime(2016, 1, 1), old2)
+                bt = BT(csp2[0])
+                bt.set_value_order(ordering, key)
+                bt.set_restarts(seed = seed)
+                runs.append([prop.__name__+' '+label+' seed '+str(seed), csp2[0], bt.solve(prop)])
+    compare_searches(runs)
+
+
+
+def var_heuristic_testing():
+    '''
+    Checks that the variable heuristics agree with each other, alone and
+    with the lcv value ordering, and that the values lcv only tries out
+    do not count in the constraint weights of dom/wdeg: every weight
+    bump must come from a dead end of the search itself.
+    '''
+    old = compose_initial_schedule(2, 6, 2)
+    due = datetime(2016, 1, 2, 23)
+    tests = [['fits', 3, 3], ['one task too many', 2, 5]]
+    for [name, n_multi, n_single] in tests:
+        print('var_heuristic_testing ('+name+') Starts. ')
+        tasks = [Task("m"+str(i), due, 2, True, 2) for i in range(n_multi)]
+        tasks = tasks + [Task("s"+str(i), due, 1, False, 1) for i in range(n_single)]
+        runs = []
+        for prop in [prop_FC, prop_GAC]:
+            for heuristic in ["mrv", "dom/wdeg", "dom/ddeg"]:
+                for ordering in ["domain", "lcv"]:
+                    csp = scheduler_csp_model(copy.deepcopy(tasks), datetime(2016, 1, 1), old)
+                    dead_ends = [0]
+
+                    def counting(csp, newVar = None, prop = prop):
+                        status, pruned = prop(csp, newVar)
+                        if(not(status) and not(csp.probing)):
+                            dead_ends[0] = dead_ends[0] + 1
+                        return status, pruned
+
+                    bt = BT(csp[0])
+                    bt.set_var_heuristic(heuristic)
+                    bt.set_value_order(ordering)
+                    label = prop.__name__+' '+heuristic+' '+ordering
+                    runs.append([label, csp[0], bt.solve(counting)])
+                    if(sum(c.weight - 1 for c in csp[0].get_all_cons()) != dead_ends[0]):
+                        print('Error: '+label+' counted values tried out in the constraint weights!')
+        compare_searches(runs)
+
+
+
+def consistent_partial(csp, assignment):
+    '''
+    Return True if the values of assignment (a dict of Variables, as in
+    a SearchResult) are in the domains of their Variables and satisfy
+    every constraint whose Variables are all in assignment.
+    '''
+    for v, val in assignment.items():
+        if(not(val in v.domain())):
+            print('Error: '+v.name+' was given a value out of its domain!')
+            return False
+    for c in csp.get_all_cons():
+        if(all(v in assignment for v in c.get_scope()) and 
+           not(c.check([assignment[v] for v in c.get_scope()]))):
+            print('Error: constraint '+c.name+' is violated by the partial assignment!')
+            return False
+    return True
+
+
+def limits_testing():
+    '''
+    A search stopped by a limit returns UNKNOWN with the deepest partial
+    assignment it reached. Checks the decision, pruning and time limits on
+    an input too hard to finish within them, that the counters stop at
+    the limit, and that the partial assignment is consistent. A limit
+    that is not reached changes nothing.
+    '''
+    print('limits_testing 1 (limit reached) Starts. ')
+    old1 = compose_initial_schedule(4, 4)
+    [tasks1, duration1] = compose_tasks_for_deadline_testing(old1, datetime(2016, 1, 1, 0), 1, 2, invalid = 1)
+    failed = False
+    for prop in [prop_FC, prop_GAC]:
+        for limits in [{"max_decisions": 500}, {"max_prunings": 1000}, {"time_limit": 0.2}]:
+            csp1 = scheduler_csp_model(copy.deepcopy(tasks1), datetime(2016, 1, 1), old1)
+            bt = BT(csp1[0])
+            bt.set_limits(**limits)
+            result = bt.solve(prop)
+            print(prop.__name__+' '+str(limits)+': '+repr(result))
+            if(result.status != SearchResult.UNKNOWN or not(result.assignment)):
+                failed = True
+                print('Error: the search did not stop at its limit with a partial assignment!')
+            elif(not(consistent_partial(csp1[0], result.assignment))):
+                failed = True
+            if(("max_decisions" in limits and result.nDecisions != limits["max_decisions"]) or 
+               ("max_prunings" in limits and result.nPrunings < limits["max_prunings"]) or
+               ("time_limit" in limits and not(limits["time_limit"] <= result.wall_time < limits["time_limit"] + 1))):
+                failed = True
+                print('Error: the search did not stop at its limit!')
+    if(not(failed)):
+        print('SUCCESS')
+    else:
+        print('SOME FAILURES')
+
+    print('limits_testing 2 (limit not reached) Starts. ')
+    old2 = compose_initial_schedule(4, 6)
+    [tasks2, duration2] = compose_tasks_for_deadline_testing(old2, datetime(2016, 1, 1, 0), 2, 2)
+    runs = []
+    for limits in [{}, {"max_decisions": 1000, "time_limit": 60}]:
+        csp2 = scheduler_csp_model(copy.deepcopy(tasks2), datetime(2016, 1, 1), old2)
+        bt = BT(csp2[0])
+        bt.set_limits(**limits)
+        runs.append([str(limits), csp2[0], bt.solve(prop_FC)])
+    compare_searches(runs)
+
+
+
+
         
     
 if __name__ == '__main__':
     
     constraint_satisfaction_testing()
     solution_optimization_testing()
+    alldiff_testing()
+    precedence_testing()
+    table_testing()
+    cumulative_testing()
+    restart_testing()
+    branch_and_bound_testing()
+    lns_testing()
+    incremental_testing()
+    parallel_testing()
+    value_order_testing()
+    var_heuristic_testing()
+    limits_testing()
    
     